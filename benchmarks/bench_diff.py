@@ -0,0 +1,154 @@
+"""Compares ways of diffing fetched flats against the stored ones of a filter.
+
+    legacy_in_clause   `WHERE url IN ('...')` built from strings, ISO text parsed per row.
+    text_join          Temp table joined on the key, ISO text timestamps compared in SQL.
+    integer_join       `storage.filter_new_estates`: the same join on epoch integers.
+
+Half of the fetched flats are stored already and a tenth of those were bumped since.
+
+Usage:
+    python -m benchmarks.bench_diff [--flats 1000 10000 100000] [--repeat 3]
+"""
+
+import argparse
+import pathlib
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from functools import partial
+
+from loguru import logger
+
+from otodom.models import Flat
+from otodom.storage import filter_new_estates, init_storage, upsert_flats, write_transaction
+
+FILTER_NAME = 'bench'
+BASE_TS = datetime(2024, 1, 1)
+
+
+def _flats(n: int, start: int, bumped_every: int = 10) -> list[Flat]:
+    return [
+        Flat(
+            url=f'https://www.otodom.pl/pl/oferta/mieszkanie-{idx}-ID{idx:x}',
+            found_ts=BASE_TS,
+            title=f'Mieszkanie {idx}',
+            picture_url=None,
+            summary_location='Warszawa',
+            price=4000 + idx % 1000,
+            created_dt=BASE_TS - timedelta(days=1),
+            pushed_up_dt=BASE_TS + timedelta(minutes=idx % 60 + 1)
+            if idx % bumped_every == 0
+            else None,
+        )
+        for idx in range(start, start + n)
+    ]
+
+
+def _text_db(path: pathlib.Path, stored: list[Flat]) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute(
+        'CREATE TABLE flats (url text not null, updated_at text, filter_name text not null, '
+        'PRIMARY KEY (url, filter_name))'
+    )
+    conn.executemany(
+        'INSERT INTO flats VALUES (?, ?, ?)',
+        ((f.url, f.created_dt.isoformat(), FILTER_NAME) for f in stored),
+    )
+    return conn
+
+
+def legacy_in_clause(conn: sqlite3.Connection, flats: list[Flat]) -> tuple[int, int]:
+    urls_in_cond = ','.join(f"'{f.url}'" for f in flats)
+    res = conn.execute(
+        f'SELECT url, updated_at FROM flats WHERE url IN ({urls_in_cond}) AND filter_name = ?',
+        [FILTER_NAME],
+    )
+    url_to_item = {t[0]: t for t in res}
+    new = [f for f in flats if f.url not in url_to_item]
+    updated = [
+        f
+        for f in flats
+        if f.url in url_to_item and f.updated_ts > datetime.fromisoformat(url_to_item[f.url][1])
+    ]
+    return len(new), len(updated)
+
+
+def text_join(conn: sqlite3.Connection, flats: list[Flat]) -> tuple[int, int]:
+    conn.execute(
+        'CREATE TEMP TABLE IF NOT EXISTS fetched (url text PRIMARY KEY, updated_at text) '
+        'WITHOUT ROWID'
+    )
+    conn.execute('DELETE FROM fetched')
+    conn.executemany(
+        'INSERT OR REPLACE INTO fetched VALUES (?, ?)',
+        ((f.url, f.updated_ts.isoformat()) for f in flats),
+    )
+    rows = conn.execute(
+        """
+        SELECT fetched.url, stored.url IS NULL
+        FROM fetched LEFT JOIN flats AS stored
+            ON stored.url = fetched.url AND stored.filter_name = ?
+        WHERE stored.url IS NULL OR fetched.updated_at > stored.updated_at
+        """,
+        [FILTER_NAME],
+    ).fetchall()
+    new = sum(is_new for _, is_new in rows)
+    return new, len(rows) - new
+
+
+def integer_join(conn: sqlite3.Connection, flats: list[Flat]) -> tuple[int, int]:
+    result = filter_new_estates(conn, flats, filter_name=FILTER_NAME)
+    return len(result.new_flats), len(result.updated_flats)
+
+
+def _bench(fn, repeat: int) -> tuple[float, tuple[int, int]]:
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started_at)
+    return best, result
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--flats', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    args.add_argument('--repeat', type=int, default=3)
+    opts = args.parse_args()
+    logger.disable('otodom')
+
+    for n in opts.flats:
+        stored, fetched = _flats(n, start=0), _flats(n, start=n // 2)
+        for f in stored:
+            f.pushed_up_dt = None
+        with tempfile.TemporaryDirectory() as data_path:
+            text_conn = _text_db(pathlib.Path(data_path) / 'text.db', stored)
+            storage_context = init_storage(pathlib.Path(data_path))
+            writer = storage_context.writer
+            with write_transaction(storage_context):
+                writer.call(upsert_flats, stored, FILTER_NAME)
+            timings = {
+                'legacy_in_clause': _bench(
+                    partial(legacy_in_clause, text_conn, fetched), opts.repeat
+                ),
+                'text_join': _bench(partial(text_join, text_conn, fetched), opts.repeat),
+                'integer_join': _bench(partial(writer.call, integer_join, fetched), opts.repeat),
+            }
+            text_conn.close()
+            writer.close()
+        results = {result for _, result in timings.values()}
+        assert len(results) == 1, f'Diffs disagree: {timings}'
+        baseline = timings['legacy_in_clause'][0]
+        print(
+            f'{n} flats ({results.pop()} new/updated): '
+            + ', '.join(
+                f'{name} {seconds * 1000:.1f} ms (x{baseline / seconds:.1f})'
+                for name, (seconds, _) in timings.items()
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Compares one-off `requests.get` calls with the pooled `HttpClient`.
+
+A local stand-in server answers every request with a listing-sized body and counts
+the connections it accepts, which shows how many TCP (and, with `--tls`, TLS)
+handshakes each approach pays for.
+
+Usage:
+    python -m benchmarks.bench_http_client [--requests 200] [--tls]
+"""
+
+import argparse
+import http.server
+import pathlib
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+import requests
+from loguru import logger
+
+from benchmarks.fixtures import synthetic_listing_html, synthetic_listing_payload
+from otodom.http_client import HttpClient
+
+BODY = synthetic_listing_html(synthetic_listing_payload()).encode('utf8')
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = 0
+    connections_lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with _Handler.connections_lock:
+            _Handler.connections += 1
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _self_signed_context(tmpdir: pathlib.Path) -> tuple[ssl.SSLContext, pathlib.Path]:
+    if not shutil.which('openssl'):
+        raise SystemExit('--tls needs the openssl binary to create a certificate')
+    cert, key = tmpdir / 'cert.pem', tmpdir / 'key.pem'
+    subprocess.run(  # noqa: S603
+        [  # noqa: S607
+            'openssl',
+            'req',
+            '-x509',
+            '-newkey',
+            'rsa:2048',
+            '-nodes',
+            '-days',
+            '1',
+            '-subj',
+            '/CN=localhost',
+            '-addext',
+            'subjectAltName=DNS:localhost',
+            '-keyout',
+            str(key),
+            '-out',
+            str(cert),
+        ],
+        check=True,
+        capture_output=True,
+    )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context, cert
+
+
+def _run(label: str, get, url: str, n_requests: int, verify):
+    _Handler.connections = 0
+    started_at = time.perf_counter()
+    for _ in range(n_requests):
+        resp = get(url, timeout=10, verify=verify)
+        resp.raise_for_status()
+        assert len(resp.content) == len(BODY)
+    elapsed = time.perf_counter() - started_at
+    print(
+        f'{label:>15}: {n_requests} requests in {elapsed:.2f}s '
+        f'({elapsed / n_requests * 1000:.2f} ms/request), '
+        f'{_Handler.connections} connections opened'
+    )
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--requests', type=int, default=200)
+    args.add_argument('--tls', action='store_true')
+    opts = args.parse_args()
+    logger.disable('otodom')
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        server = http.server.ThreadingHTTPServer(('localhost', 0), _Handler)
+        verify = True
+        if opts.tls:
+            context, cert = _self_signed_context(pathlib.Path(tmpdir))
+            server.socket = context.wrap_socket(server.socket, server_side=True)
+            verify = str(cert)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'{"https" if opts.tls else "http"}://localhost:{server.server_port}/'
+
+        client = HttpClient()
+        try:
+            _run('requests.get', requests.get, url, opts.requests, verify)
+            _run('HttpClient', client.get, url, opts.requests, verify)
+        finally:
+            client.close()
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
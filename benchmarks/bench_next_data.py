@@ -0,0 +1,57 @@
+"""Compares the `__NEXT_DATA__` extractor against the previous BeautifulSoup path.
+
+Usage:
+    python -m benchmarks.bench_next_data [recorded_page.html ...]
+
+Without arguments a synthetic page of realistic size is used.
+"""
+
+import json
+import pathlib
+import sys
+import timeit
+
+from bs4 import BeautifulSoup
+
+from benchmarks.fixtures import synthetic_listing_html, synthetic_listing_payload
+from otodom.next_data import extract_next_data
+
+
+def soup_next_data(html: str) -> tuple[dict, bool]:
+    soup = BeautifulSoup(html, 'html.parser')
+    payload = json.loads(soup.find_all(attrs={'id': '__NEXT_DATA__'})[0].text)
+    is_empty = bool(soup.find_all(attrs={'data-cy': 'no-search-results'}))
+    return payload, is_empty
+
+
+def extractor_next_data(html: str) -> tuple[dict, bool]:
+    payload = extract_next_data(html)
+    is_empty = not payload['props']['pageProps']['data']['searchAds']['items']
+    return payload, is_empty
+
+
+def _bench(name: str, html: str, repeat: int = 5):
+    assert soup_next_data(html)[0] == extractor_next_data(html)[0], 'Payloads differ'
+    results = {}
+    for label, fn in (('beautifulsoup', soup_next_data), ('extractor', extractor_next_data)):
+        number = 3 if label == 'beautifulsoup' else 100
+        best = min(timeit.repeat(lambda fn=fn: fn(html), number=number, repeat=repeat)) / number
+        results[label] = best
+    print(
+        f'{name}: {len(html) / 1024:.0f} KiB, '
+        f'beautifulsoup {results["beautifulsoup"] * 1000:.2f} ms/page, '
+        f'extractor {results["extractor"] * 1000:.2f} ms/page, '
+        f'speedup x{results["beautifulsoup"] / results["extractor"]:.1f}'
+    )
+
+
+def main(paths: list[str]):
+    if paths:
+        for path in paths:
+            _bench(path, pathlib.Path(path).read_text())
+    else:
+        _bench('synthetic', synthetic_listing_html(synthetic_listing_payload()))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
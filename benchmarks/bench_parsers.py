@@ -0,0 +1,238 @@
+"""Throughput and memory of the parsing hot paths, offline.
+
+Cases:
+    listing_page       `OtodomFlatsPageParser` from HTML, scaled synthetic listing pages.
+    archived_listing   `OtodomFlatsPageParser` on payloads from `--archive` (real data).
+    flat_page          `parse_flat_html` on offer pages built from `fixtures/flat_page.json`.
+    seizbil_table      `seizbil.parser.parse_table` on tables from `fixtures/seizbil_table.html`.
+    stolodataservice   `record_to_offering` of the stock locator, 25 hits per page.
+    najlepszeoferty    `record_to_offering` of the used cars search, 23 records per page.
+
+Every case runs in a fresh process, so its peak RSS is not inflated by the cases before
+it. Allocations are traced with `tracemalloc` on a separate, shorter pass, because
+tracing slows the parsers down several times.
+
+Usage:
+    python -m benchmarks.bench_parsers [--listings 10000] [--case listing_page ...]
+        [--archive data/json] [--output bench_parsers.json] [--baseline previous.json]
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import pathlib
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+from loguru import logger
+
+from benchmarks.fixtures import (
+    scaled_flat_pages,
+    scaled_listing_pages,
+    scaled_najlepszeoferty_records,
+    scaled_seizbil_tables,
+    scaled_stolodataservice_hits,
+)
+from otodom.archive import PayloadArchive
+from otodom.cars.parsers import najlepszeoferty_bmw, stolodataservice
+from otodom.flat_filter import EstateFilter
+from otodom.flat_page_parser import parse_flat_html
+from otodom.listing_page_parser import OtodomFlatsPageParser
+from otodom.seizbil.parser import parse_table
+
+# Offer pages are large, so only this many distinct ones are kept in memory and cycled.
+DISTINCT_FLAT_PAGES = 500
+TRACED_PAGES = 50
+
+# A case builds its inputs and returns them with the number of pages to parse and a
+# function parsing one page into a list of records.
+Case = Callable[[int, pathlib.Path | None], tuple[list, int, Callable[[object], list]]]
+
+
+def _chunks(items: list, size: int) -> list[list]:
+    return [items[start : start + size] for start in range(0, len(items), size)]
+
+
+def _listing_page_case(n_listings: int, archive_path: pathlib.Path | None):
+    pages = scaled_listing_pages(n_listings)
+    now, filter = datetime.now(), EstateFilter('bench')
+    return (
+        pages,
+        len(pages),
+        lambda html: OtodomFlatsPageParser.from_html(html, now=now, filter=filter).parse(),
+    )
+
+
+def _archived_listing_case(n_listings: int, archive_path: pathlib.Path | None):
+    if archive_path is None:
+        raise ValueError('The archived_listing case needs --archive')
+    archive = PayloadArchive(archive_path)
+    payloads, listings = [], 0
+    for record in archive.records():
+        payload = archive.read(record)
+        payloads.append(payload)
+        listings += len(payload['props']['pageProps']['data']['searchAds']['items'])
+        if listings >= n_listings:
+            break
+    now, filter = datetime.now(), EstateFilter('bench')
+    return (
+        payloads,
+        len(payloads),
+        lambda payload: OtodomFlatsPageParser(
+            payload=payload, now=now, html='', filter=filter
+        ).parse(),
+    )
+
+
+def _flat_page_case(n_listings: int, archive_path: pathlib.Path | None):
+    pages = scaled_flat_pages(min(n_listings, DISTINCT_FLAT_PAGES))
+    return pages, n_listings, lambda html: [parse_flat_html(html)]
+
+
+def _seizbil_table_case(n_listings: int, archive_path: pathlib.Path | None):
+    tables = scaled_seizbil_tables(n_listings)
+    return tables, len(tables), lambda table: parse_table(table).to_dict('records')
+
+
+def _stolodataservice_case(n_listings: int, archive_path: pathlib.Path | None):
+    pages = _chunks(scaled_stolodataservice_hits(n_listings), 25)
+    return pages, len(pages), lambda hits: [stolodataservice.record_to_offering(r) for r in hits]
+
+
+def _najlepszeoferty_case(n_listings: int, archive_path: pathlib.Path | None):
+    pages = _chunks(
+        scaled_najlepszeoferty_records(n_listings), najlepszeoferty_bmw.MAX_RESULTS_IN_BATCH
+    )
+    return (
+        pages,
+        len(pages),
+        lambda records: [najlepszeoferty_bmw.record_to_offering(r, image_urls=[]) for r in records],
+    )
+
+
+CASES: dict[str, Case] = {
+    'listing_page': _listing_page_case,
+    'archived_listing': _archived_listing_case,
+    'flat_page': _flat_page_case,
+    'seizbil_table': _seizbil_table_case,
+    'stolodataservice': _stolodataservice_case,
+    'najlepszeoferty': _najlepszeoferty_case,
+}
+DEFAULT_CASES = [name for name in CASES if name != 'archived_listing']
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _pages(inputs: list, n_pages: int):
+    return (inputs[idx % len(inputs)] for idx in range(n_pages))
+
+
+def _measure(case_name: str, n_listings: int, archive_path: pathlib.Path | None) -> dict:
+    logger.disable('otodom')
+    inputs, n_pages, parse = CASES[case_name](n_listings, archive_path)
+    parse(inputs[0])  # Warms up lazy imports and compiled patterns.
+    gc.collect()
+    rss_before = _peak_rss_bytes()
+
+    started_at = time.perf_counter()
+    listings = sum(len(parse(page)) for page in _pages(inputs, n_pages))
+    seconds = time.perf_counter() - started_at
+    peak_rss = _peak_rss_bytes()
+
+    traced_pages = list(islice(_pages(inputs, n_pages), TRACED_PAGES))
+    gc.collect()
+    tracemalloc.start()
+    # Results are kept alive like in the fetch cycle, which holds a whole crawl.
+    results = [parse(page) for page in traced_pages]
+    retained_bytes, traced_peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    traced_listings = sum(map(len, results)) or 1
+
+    return {
+        'pages': n_pages,
+        'listings': listings,
+        'seconds': round(seconds, 4),
+        'pages_per_second': round(n_pages / seconds, 2),
+        'listings_per_second': round(listings / seconds, 2),
+        'peak_rss_mib': round(peak_rss / 2**20, 1),
+        'rss_growth_mib': round((peak_rss - rss_before) / 2**20, 1),
+        'traced_peak_bytes_per_listing': traced_peak_bytes // traced_listings,
+        'retained_bytes_per_listing': retained_bytes // traced_listings,
+    }
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],  # noqa: S607
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_comparison(results: dict, baseline: dict):
+    for name, case in results['cases'].items():
+        previous = baseline.get('cases', {}).get(name)
+        if not previous:
+            continue
+        speed = case['listings_per_second'] / previous['listings_per_second'] - 1
+        memory = case['traced_peak_bytes_per_listing'] - previous['traced_peak_bytes_per_listing']
+        print(f'{name}: listings/s {speed:+.1%}, traced peak bytes/listing {memory:+d}')
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--listings', type=int, default=10_000)
+    args.add_argument('--case', choices=sorted(CASES), action='append')
+    args.add_argument('--archive', type=pathlib.Path, help='A `data/json` payload archive.')
+    args.add_argument('--output', type=pathlib.Path, default=pathlib.Path('bench_parsers.json'))
+    args.add_argument('--baseline', type=pathlib.Path, help='Results of a previous run.')
+    opts = args.parse_args()
+
+    case_names = opts.case or DEFAULT_CASES + (['archived_listing'] if opts.archive else [])
+    results = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'listings': opts.listings,
+        'cases': {},
+    }
+    for name in case_names:
+        # A fresh interpreter per case keeps peak RSS and allocator state independent.
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context('spawn')
+        ) as pool:
+            case = pool.submit(_measure, name, opts.listings, opts.archive).result()
+        results['cases'][name] = case
+        print(
+            f'{name}: {case["pages_per_second"]:.1f} pages/s, '
+            f'{case["listings_per_second"]:.0f} listings/s, '
+            f'peak RSS {case["peak_rss_mib"]:.0f} MiB (+{case["rss_growth_mib"]:.0f}), '
+            f'{case["traced_peak_bytes_per_listing"]} B traced peak/listing'
+        )
+
+    opts.output.write_text(json.dumps(results, indent=2) + '\n')
+    print(f'Results written to {opts.output}')
+    if opts.baseline:
+        _print_comparison(results, json.loads(opts.baseline.read_text()))
+
+
+if __name__ == '__main__':
+    main()
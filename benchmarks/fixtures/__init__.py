@@ -0,0 +1,197 @@
+"""Synthetic, realistically sized pages for offline benchmarks.
+
+Recorded pages can always be used instead; these only exist so that the benchmarks
+run on a fresh checkout without network access. The JSON and HTML files next to this
+module are saved responses of the other scraped sites, which the `scaled_*` helpers
+replicate to any number of records.
+"""
+
+import html as html_lib
+import pathlib
+import random
+import re
+
+import orjson
+
+FIXTURES_PATH = pathlib.Path(__file__).parent
+
+_DISTRICTS = ('mokotow', 'wola', 'ochota', 'srodmiescie', 'zoliborz')
+
+
+def synthetic_listing_item(idx: int, rng: random.Random) -> dict:
+    district = rng.choice(_DISTRICTS)
+    return {
+        'id': 60_000_000 + idx,
+        'slug': f'mieszkanie-{district}-{idx}-ID{idx:x}',
+        'title': f'Mieszkanie {rng.randint(30, 120)} m2, {district.capitalize()}, oferta {idx}',
+        'estate': 'FLAT',
+        'transaction': 'RENT',
+        'isPrivateOwner': rng.random() < 0.3,
+        'images': [
+            {
+                'medium': f'https://ireland.apollo.olxcdn.com/v1/files/{idx}-{n}/image;s=655x491;q=80',
+                'large': f'https://ireland.apollo.olxcdn.com/v1/files/{idx}-{n}/image;s=1280x1024;q=80',
+                'small': f'https://ireland.apollo.olxcdn.com/v1/files/{idx}-{n}/image;s=184x138;q=80',
+            }
+            for n in range(rng.randint(1, 4))
+        ],
+        'totalPrice': {'value': rng.randint(2500, 9000), 'currency': 'PLN'},
+        'rentPrice': {'value': rng.randint(300, 900), 'currency': 'PLN'},
+        'areaInSquareMeters': round(rng.uniform(25, 130), 2),
+        'roomsNumber': rng.choice(('ONE', 'TWO', 'THREE', 'FOUR')),
+        'dateCreated': f'2024-0{rng.randint(1, 9)}-1{rng.randint(0, 9)} 1{rng.randint(0, 9)}:2{rng.randint(0, 9)}:00',
+        'pushedUpAt': (
+            f'2024-10-1{rng.randint(0, 9)}T0{rng.randint(0, 9)}:00:00+02:00'
+            if rng.random() < 0.5
+            else None
+        ),
+        'shortDescription': ' '.join(rng.choices(('jasne', 'ciche', 'balkon', 'metro'), k=40)),
+        'location': {
+            'address': {'street': {'name': f'ul. Testowa {idx}', 'number': str(idx % 90)}},
+            'reverseGeocoding': {
+                'locations': [
+                    {
+                        'id': 'mazowieckie',
+                        'fullName': 'mazowieckie',
+                        'locationLevel': 'region',
+                    },
+                    {
+                        'id': 'mazowieckie/warszawa/warszawa/warszawa',
+                        'fullName': 'Warszawa',
+                        'locationLevel': 'city',
+                    },
+                    {
+                        'id': f'mazowieckie/warszawa/warszawa/warszawa/{district}',
+                        'fullName': district.capitalize(),
+                        'locationLevel': 'district',
+                    },
+                ]
+            },
+        },
+    }
+
+
+def synthetic_listing_payload(n_items: int = 36, seed: int = 0, total_pages: int = 1) -> dict:
+    rng = random.Random(seed)
+    items = [synthetic_listing_item(seed * 1_000_000 + idx, rng) for idx in range(n_items)]
+    return {
+        'props': {
+            'pageProps': {
+                'data': {
+                    'searchAds': {
+                        'items': items,
+                        'pagination': {
+                            'totalPages': total_pages,
+                            'totalResults': n_items * total_pages,
+                            'itemsPerPage': n_items,
+                        },
+                    },
+                    'searchAdsRandomPromoted': {'items': []},
+                },
+            }
+        },
+        'page': '/[lang]/results/[[...searchingCriteria]]',
+        'buildId': 'synthetic',
+    }
+
+
+def _next_data_html(payload: dict, main: str, filler_blocks: int) -> str:
+    filler = '\n'.join(
+        f'<div class="css-{idx}f"><style>.css-{idx}f{{display:flex;margin:{idx % 7}px}}</style>'
+        f'<ul><li><a href="/pl/link-{idx}">Link {idx}</a></li><li><span>{idx}</span></li></ul></div>'
+        for idx in range(filler_blocks)
+    )
+    return (
+        '<!DOCTYPE html><html lang="pl"><head><meta charset="utf-8"><title>Otodom</title>'
+        '<script>window.__NEXT_DATA_LOADED__ = false;</script></head><body><div id="__next">'
+        f'{filler}<main>{main}</main></div>'
+        '<script id="__NEXT_DATA__" type="application/json">'
+        f'{orjson.dumps(payload).decode()}</script></body></html>'
+    )
+
+
+def synthetic_listing_html(payload: dict, filler_blocks: int = 1500) -> str:
+    """Wraps the payload into markup of roughly the size of a real otodom listing page."""
+    items = payload['props']['pageProps']['data']['searchAds']['items']
+    articles = '\n'.join(
+        f'<article data-cy="listing-item"><div class="css-{idx}x"><a href="/pl/oferta/'
+        f'{item["slug"]}"><p class="css-title">{html_lib.escape(item["title"])}</p></a>'
+        f'<span class="css-price">{item["totalPrice"]["value"]} zł/mc</span></div></article>'
+        for idx, item in enumerate(items)
+    )
+    return _next_data_html(payload, articles, filler_blocks)
+
+
+def load_json_fixture(name: str) -> dict:
+    return orjson.loads((FIXTURES_PATH / name).read_bytes())
+
+
+def scaled_listing_pages(
+    n_listings: int, items_per_page: int = 36, filler_blocks: int = 1500
+) -> list[str]:
+    """Listing pages holding `n_listings` distinct items in total."""
+    n_pages = -(-n_listings // items_per_page)
+    return [
+        synthetic_listing_html(
+            synthetic_listing_payload(
+                n_items=min(items_per_page, n_listings - page_idx * items_per_page),
+                seed=page_idx,
+                total_pages=n_pages,
+            ),
+            filler_blocks=filler_blocks,
+        )
+        for page_idx in range(n_pages)
+    ]
+
+
+def scaled_flat_pages(n_pages: int, filler_blocks: int = 1000) -> list[str]:
+    """Offer pages built from the saved `flat_page.json`, each with its own id and slug."""
+    template = load_json_fixture('flat_page.json')
+    pages = []
+    for idx in range(n_pages):
+        payload = orjson.loads(orjson.dumps(template))
+        ad = payload['props']['pageProps']['ad']
+        ad['id'] += idx
+        ad['slug'] = f'{ad["slug"]}-{idx}'
+        ad['url'] = f'https://www.otodom.pl/pl/oferta/{ad["slug"]}'
+        description = (
+            f'<article><h1>{html_lib.escape(ad["title"])}</h1>{ad["description"]}</article>'
+        )
+        pages.append(_next_data_html(payload, description, filler_blocks))
+    return pages
+
+
+_SEIZBIL_ROW_RE = re.compile(r'<tr class="xspRow">.*?</tr>', re.DOTALL)
+_SEIZBIL_DOCUMENT_ID_RE = re.compile(r'documentId=[0-9A-F]+')
+
+
+def scaled_seizbil_tables(n_rows: int, rows_per_table: int = 10) -> list[str]:
+    """Result tables built from the rows of the saved `seizbil_table.html`."""
+    template = (FIXTURES_PATH / 'seizbil_table.html').read_text()
+    template_rows = _SEIZBIL_ROW_RE.findall(template)
+    head, tail = template.split(template_rows[0], 1)[0], template.rsplit(template_rows[-1], 1)[1]
+    rows = [
+        _SEIZBIL_DOCUMENT_ID_RE.sub(
+            f'documentId={idx:032X}', template_rows[idx % len(template_rows)]
+        )
+        for idx in range(n_rows)
+    ]
+    return [
+        head + '\n'.join(rows[start : start + rows_per_table]) + tail
+        for start in range(0, n_rows, rows_per_table)
+    ]
+
+
+def scaled_stolodataservice_hits(n_records: int) -> list[dict]:
+    template = load_json_fixture('stolodataservice_hit.json')
+    records = []
+    for idx in range(n_records):
+        record = orjson.loads(orjson.dumps(template))
+        record['vehicle']['documentId'] = f'{record["vehicle"]["documentId"][:-6]}{idx:06d}'
+        records.append(record)
+    return records
+
+
+def scaled_najlepszeoferty_records(n_records: int) -> list[dict]:
+    template = load_json_fixture('najlepszeoferty_record.json')
+    return [template | {'id': template['id'] + idx} for idx in range(n_records)]
@@ -1,27 +1,73 @@
+import pathlib
 import sqlite3
 from collections.abc import Sequence
+from contextlib import closing
 from datetime import datetime
 from operator import attrgetter
 
 import click
 import pytz
 import timeago
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.schedulers.blocking import BlockingScheduler
 from loguru import logger
 from tqdm import tqdm
 
+from otodom.archive import PayloadArchive
 from otodom.cars import fetch_car_offerings_impl
-from otodom.fetch import fetch_and_report
+from otodom.export import DEFAULT_CHUNK_SIZE, EXPORT_FORMATS, export_flats
+from otodom.fetch import fetch_and_report, replay_archive
 from otodom.filter_parser import parse_flats_for_filter
 from otodom.flat_filter import FILTERS, EstateFilter
 from otodom.flat_page_parser import parse_flat_page
+from otodom.image_processing import DEFAULT_JPEG_QUALITY, ImageProcessor
+from otodom.migrations import get_schema_version, migrate, pending_migrations
 from otodom.models import Flat
+from otodom.outbox import OutboxSender, TelegramOutbox, get_legacy_outbox_db_file
+from otodom.photo_cache import PhotoCache, get_photo_cache_path
 from otodom.report import CANONICAL_CHANNEL_IDS, _send_flat_summary, report_message
+from otodom.retention import run_retention
 from otodom.seizbil.fetcher import fetch_seizbil_offerings_impl
+from otodom.storage import get_db_file, init_storage
+from otodom.telegram_media import TelegramMediaCache, get_telegram_media_db_file
 from otodom.telegram_sync import SyncBot, escape_markdown
 from otodom.util import dt_to_naive_utc
 
 
+def _create_bot(
+    bot_token: str,
+    api_id: int,
+    api_hash: str,
+    data_path: str,
+    photo_max_edge: int | None = None,
+    photo_quality: int = DEFAULT_JPEG_QUALITY,
+) -> SyncBot:
+    """A bot keeping its photos and their Telegram references under `data_path`.
+
+    With `photo_max_edge`, photos are downscaled before they are cached and uploaded.
+    """
+    base_data_path = pathlib.Path(data_path).absolute()
+    image_processor = (
+        ImageProcessor(max_edge=photo_max_edge, quality=photo_quality) if photo_max_edge else None
+    )
+    return SyncBot.from_bot_token(
+        bot_token=bot_token,
+        api_id=api_id,
+        api_hash=api_hash,
+        photo_cache=PhotoCache(
+            get_photo_cache_path(base_data_path), image_processor=image_processor
+        ),
+        media_cache=TelegramMediaCache(get_telegram_media_db_file(base_data_path)),
+    )
+
+
+def _open_outbox(data_path: str) -> TelegramOutbox:
+    base_data_path = pathlib.Path(data_path).absolute()
+    return TelegramOutbox(
+        get_db_file(base_data_path), legacy_path=get_legacy_outbox_db_file(base_data_path)
+    )
+
+
 def _parse_channel_id(telegram_channel_id: str):
     return CANONICAL_CHANNEL_IDS.get(telegram_channel_id) or int(telegram_channel_id)
 
@@ -53,12 +99,29 @@ def cli():
 @click.option('--api-hash', type=str, required=True, help='The Telegram API hash.')
 @click.option('--send-report', default=True, help='Send report to the Channel.')
 @click.option('--filter', '-f', type=str, multiple=True, help='Names of the filters to use')
+@click.option(
+    '--incremental/--full',
+    default=True,
+    help='Stop paginating once pages contain only known flats, with periodic full sweeps.',
+)
 @click.option(
     '--telegram-channel-id',
     required=True,
     type=str,
     help='Telegram channel ID. Can be the name of the channel stored in the internal registry (CANONICAL_CHANNEL_IDS).',
 )
+@click.option(
+    '--photo-max-edge',
+    type=int,
+    default=None,
+    help='Downscale photos to this many pixels on the longer edge before uploading. Needs Pillow.',
+)
+@click.option(
+    '--photo-quality',
+    type=click.IntRange(1, 95),
+    default=DEFAULT_JPEG_QUALITY,
+    help='JPEG quality of the downscaled photos.',
+)
 def fetch(
     data_path: str,
     bot_token: str,
@@ -67,20 +130,43 @@ def fetch(
     telegram_channel_id: str,
     api_id: int,
     api_hash: str,
+    incremental: bool,
+    photo_max_edge: int | None,
+    photo_quality: int,
 ):
-    bot = SyncBot.from_bot_token(bot_token=bot_token, api_id=api_id, api_hash=api_hash)
-    telegram_channel_id = _parse_channel_id(telegram_channel_id)
-    _report_on_launch(telegram_channel_id=telegram_channel_id, bot=bot, filters=filter)
-    fetch_and_report(
+    bot = _create_bot(
+        bot_token=bot_token,
+        api_id=api_id,
+        api_hash=api_hash,
         data_path=data_path,
-        bot=bot,
-        send_report=send_report,
-        telegram_channel_id=telegram_channel_id,
-        filters=filter,
+        photo_max_edge=photo_max_edge,
+        photo_quality=photo_quality,
     )
+    telegram_channel_id = _parse_channel_id(telegram_channel_id)
+    _report_on_launch(telegram_channel_id=telegram_channel_id, bot=bot, filters=filter)
+    outbox = _open_outbox(data_path)
+    sender = OutboxSender(bot, outbox)
+    sender.start()
+    try:
+        fetch_and_report(
+            data_path=data_path,
+            bot=bot,
+            send_report=send_report,
+            telegram_channel_id=telegram_channel_id,
+            filters=filter,
+            incremental=incremental,
+        )
+    finally:
+        if undelivered := sender.flush():
+            logger.warning('{} reports stay in the outbox for the next run', undelivered)
 
 
 @cli.command()
+@click.option(
+    '--data-path',
+    default='.',
+    help='The path to keep the cached photos and their Telegram references in.',
+)
 @click.option(
     '--redis-host',
     required=True,
@@ -112,6 +198,18 @@ def fetch(
     type=str,
     help='Telegram channel ID. Can be the name of the channel stored in the internal registry (CANONICAL_CHANNEL_IDS).',
 )
+@click.option(
+    '--photo-max-edge',
+    type=int,
+    default=None,
+    help='Downscale photos to this many pixels on the longer edge before uploading. Needs Pillow.',
+)
+@click.option(
+    '--photo-quality',
+    type=click.IntRange(1, 95),
+    default=DEFAULT_JPEG_QUALITY,
+    help='JPEG quality of the downscaled photos.',
+)
 def fetch_car_offerings(
     redis_host: str,
     redis_port: int,
@@ -121,9 +219,19 @@ def fetch_car_offerings(
     api_hash: str,
     bot_token: str,
     telegram_channel_id: str,
+    data_path: str,
+    photo_max_edge: int | None,
+    photo_quality: int,
 ):
     telegram_channel_id = _parse_channel_id(telegram_channel_id)
-    bot = SyncBot.from_bot_token(bot_token=bot_token, api_hash=api_hash, api_id=api_id)
+    bot = _create_bot(
+        bot_token=bot_token,
+        api_id=api_id,
+        api_hash=api_hash,
+        data_path=data_path,
+        photo_max_edge=photo_max_edge,
+        photo_quality=photo_quality,
+    )
     fetch_car_offerings_impl(
         redis_host,
         redis_port,
@@ -209,6 +317,28 @@ def fetch_seizbil_offerings(
 @click.option('--send-report', default=True, help='Send report to the Channel.')
 @click.option('--minutes', default=15, help='Run every.')
 @click.option('--filter', '-f', type=str, multiple=True, help='Names of the filters to use')
+@click.option(
+    '--incremental/--full',
+    default=True,
+    help='Stop paginating once pages contain only known flats, with periodic full sweeps.',
+)
+@click.option(
+    '--retention-days',
+    default=90,
+    help='Archive listings not seen for this many days, nightly. 0 keeps everything.',
+)
+@click.option(
+    '--photo-max-edge',
+    type=int,
+    default=None,
+    help='Downscale photos to this many pixels on the longer edge before uploading. Needs Pillow.',
+)
+@click.option(
+    '--photo-quality',
+    type=click.IntRange(1, 95),
+    default=DEFAULT_JPEG_QUALITY,
+    help='JPEG quality of the downscaled photos.',
+)
 def fetch_every(
     data_path: str,
     send_report: bool,
@@ -218,12 +348,26 @@ def fetch_every(
     api_hash: str,
     bot_token: str,
     telegram_channel_id: str,
+    incremental: bool,
+    retention_days: int,
+    photo_max_edge: int | None,
+    photo_quality: int,
 ):
-    bot = SyncBot.from_bot_token(bot_token=bot_token, api_hash=api_hash, api_id=api_id)
+    bot = _create_bot(
+        bot_token=bot_token,
+        api_id=api_id,
+        api_hash=api_hash,
+        data_path=data_path,
+        photo_max_edge=photo_max_edge,
+        photo_quality=photo_quality,
+    )
     telegram_channel_id = _parse_channel_id(telegram_channel_id)
     logger.info('Scheduling fetch every {} minutes', minutes)
     _report_on_launch(telegram_channel_id=telegram_channel_id, bot=bot, filters=filter)
-    scheduler = BlockingScheduler()
+    OutboxSender(bot, _open_outbox(data_path)).start()
+    # One worker runs the jobs one after another, so retention never competes with a fetch
+    # cycle for the DB.
+    scheduler = BlockingScheduler(executors={'default': ThreadPoolExecutor(max_workers=1)})
     scheduler.add_job(
         fetch_and_report,
         'interval',
@@ -235,6 +379,7 @@ def fetch_every(
             'send_report': send_report,
             'telegram_channel_id': telegram_channel_id,
             'filters': filter,
+            'incremental': incremental,
         },
         next_run_time=datetime.now(),
     )
@@ -254,9 +399,106 @@ def fetch_every(
             ),
         },
     )
+    if retention_days:
+        scheduler.add_job(
+            run_retention,
+            'cron',
+            hour=4,
+            id='retention',
+            kwargs={'data_path': data_path, 'retention_days': retention_days},
+        )
     scheduler.start()
 
 
+@cli.command()
+@click.option(
+    '--data-path',
+    default='.',
+    help='The path of the SQLite DB to replay into. It is created if missing.',
+)
+@click.option(
+    '--archive-path',
+    default=None,
+    help='The payload archive to replay, `<data-path>/data/json` by default.',
+)
+@click.option('--since', type=click.DateTime(['%Y-%m-%d']), help='First day to replay.')
+@click.option('--until', type=click.DateTime(['%Y-%m-%d']), help='Last day to replay.')
+@click.option('--filter', '-f', type=str, multiple=True, help='Names of the filters to replay')
+def replay(
+    data_path: str,
+    archive_path: str | None,
+    since: datetime | None,
+    until: datetime | None,
+    filter: list[str],
+):
+    storage_context = init_storage(pathlib.Path(data_path).absolute())
+    archive = PayloadArchive(
+        pathlib.Path(archive_path).absolute() if archive_path else storage_context.raw_json_path
+    )
+    with closing(storage_context.writer):
+        cycles = replay_archive(
+            storage_context,
+            archive,
+            since=since.date() if since else None,
+            until=until.date() if until else None,
+            filter_names=filter,
+        )
+    logger.info('Replayed {} fetch cycles from {}', cycles, archive.path)
+
+
+@cli.command('migrate')
+@click.option(
+    '--data-path',
+    default='.',
+    help='The path to use to store SQLite DB and other data.',
+)
+@click.option('--dry-run', is_flag=True, help='Only list the pending migrations.')
+def migrate_db(data_path: str, dry_run: bool):
+    db_file = get_db_file(pathlib.Path(data_path).absolute())
+    if not db_file.exists():
+        raise click.ClickException(f'No DB at {db_file}')
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    logger.info('{} is at schema version {}', db_file, get_schema_version(conn))
+    for migration in pending_migrations(conn):
+        logger.info('Pending migration: {}', migration.__name__)
+    if not dry_run:
+        started_at = datetime.now()
+        version = migrate(conn)
+        logger.info('Migrated to schema version {} in {}', version, datetime.now() - started_at)
+    conn.close()
+
+
+@cli.command()
+@click.option(
+    '--data-path',
+    default='.',
+    help='The path to use to store SQLite DB and other data.',
+)
+@click.option(
+    '--output-path',
+    required=True,
+    help='Where to write the export. Rows exported there before are skipped.',
+)
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='parquet')
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, help='Rows per written batch.')
+def export(data_path: str, output_path: str, fmt: str, chunk_size: int):
+    db_file = get_db_file(pathlib.Path(data_path).absolute())
+    if not db_file.exists():
+        raise click.ClickException(f'No DB at {db_file}')
+    export_flats(db_file, pathlib.Path(output_path).absolute(), fmt=fmt, chunk_size=chunk_size)
+
+
+@cli.command()
+@click.option(
+    '--data-path',
+    default='.',
+    help='The path to use to store SQLite DB and other data.',
+)
+@click.option('--retention-days', default=90, help='Archive listings not seen for this many days.')
+def retention(data_path: str, retention_days: int):
+    run_retention(data_path, retention_days=retention_days)
+
+
 @cli.command()
 def print_flats():
     ts = datetime.now().replace(tzinfo=pytz.timezone('Europe/Warsaw'))
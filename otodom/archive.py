@@ -0,0 +1,94 @@
+import gzip
+import heapq
+import pathlib
+import threading
+from collections.abc import Iterator, Sequence
+from datetime import date, datetime
+
+import orjson
+from pydantic import BaseModel
+
+ARCHIVE_SUFFIX = '.jsonl.gz'
+INDEX_SUFFIX = '.index.jsonl'
+
+
+class ArchiveRecord(BaseModel):
+    """Index entry of one archived `__NEXT_DATA__` payload."""
+
+    # Byte range of the gzip member that holds the payload in the archive file.
+    offset: int
+    length: int
+    url: str
+    # The timestamp of the fetch cycle, shared by all pages fetched in it.
+    ts: datetime
+    query: str
+    # Names of the filters evaluated against the payload, see `otodom.query_planner`.
+    members: list[str]
+
+
+class PayloadArchive:
+    """Append-only archive of listing page payloads under `data/json`.
+
+    Payloads go to `<YYYY-MM-DD>/<query>.jsonl.gz`, one gzip member per payload, so the
+    file is a valid gzip stream of JSON lines and any payload can be read on its own
+    from its byte range. The range is appended to `<query>.index.jsonl` only after the
+    payload is written, so an interrupted write leaves unindexed bytes, never a broken
+    index entry.
+    """
+
+    def __init__(self, path: pathlib.Path, compresslevel: int = 6):
+        self.path = path
+        self.compresslevel = compresslevel
+        self._lock = threading.Lock()
+
+    def _day_path(self, day: date) -> pathlib.Path:
+        return self.path / day.isoformat()
+
+    def append(
+        self, ts: datetime, query: str, url: str, payload: dict, members: Sequence[str]
+    ) -> ArchiveRecord:
+        member = gzip.compress(orjson.dumps(payload) + b'\n', compresslevel=self.compresslevel)
+        day_path = self._day_path(ts.date())
+        with self._lock:
+            day_path.mkdir(parents=True, exist_ok=True)
+            with (day_path / f'{query}{ARCHIVE_SUFFIX}').open('ab') as f:
+                offset = f.tell()
+                f.write(member)
+            record = ArchiveRecord(
+                offset=offset, length=len(member), url=url, ts=ts, query=query, members=members
+            )
+            with (day_path / f'{query}{INDEX_SUFFIX}').open('ab') as f:
+                f.write(record.model_dump_json().encode('utf8') + b'\n')
+        return record
+
+    def read(self, record: ArchiveRecord) -> dict:
+        archive_path = self._day_path(record.ts.date()) / f'{record.query}{ARCHIVE_SUFFIX}'
+        with archive_path.open('rb') as f:
+            f.seek(record.offset)
+            return orjson.loads(gzip.decompress(f.read(record.length)))
+
+    def days(self) -> list[date]:
+        return sorted(
+            date.fromisoformat(p.name)
+            for p in self.path.iterdir()
+            if p.is_dir() and p.name[:1].isdigit()
+        )
+
+    def _iter_index(self, index_path: pathlib.Path) -> Iterator[ArchiveRecord]:
+        with index_path.open('rb') as f:
+            for line in f:
+                if line.strip():
+                    yield ArchiveRecord.model_validate_json(line)
+
+    def records(
+        self, since: date | None = None, until: date | None = None
+    ) -> Iterator[ArchiveRecord]:
+        """Yields index entries of the days in `[since, until]` ordered by cycle timestamp."""
+        for day in self.days():
+            if (since and day < since) or (until and day > until):
+                continue
+            index_paths = sorted(self._day_path(day).glob(f'*{INDEX_SUFFIX}'))
+            # Each index is already in fetch order, so merging them keeps cycles together.
+            yield from heapq.merge(
+                *(self._iter_index(p) for p in index_paths), key=lambda r: (r.ts, r.query)
+            )
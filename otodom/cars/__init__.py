@@ -8,7 +8,7 @@ from loguru import logger
 from otodom.cars.parsers.car_searcher import CarSearcher
 from otodom.cars.parsers.najlepszeoferty_bmw import UserBmwCarsSearchRequestBuilder
 from otodom.cars.parsers.stolodataservice import BmwSearchRequestBuilder
-from otodom.cars.report import report_offering
+from otodom.cars.report import report_offerings
 from otodom.cars.repository import CarsRepository
 from otodom.report import report_message
 from otodom.telegram_sync import SyncBot
@@ -31,20 +31,11 @@ def fetch_and_report(
     offerings = request_builder.search_all()
     new_offerings, updated_offerings = repo.remove_existing_offerings(offerings)
 
-    for o in new_offerings:
-        report_offering(
-            o,
-            'NEW',
-            bot=bot,
-            telegram_channel_id=telegram_channel_id,
-        )
-    for o in updated_offerings:
-        report_offering(
-            o,
-            'UPDATED',
-            bot=bot,
-            telegram_channel_id=telegram_channel_id,
-        )
+    report_offerings(
+        [(o, 'NEW') for o in new_offerings] + [(o, 'UPDATED') for o in updated_offerings],
+        bot=bot,
+        telegram_channel_id=telegram_channel_id,
+    )
     for o in chain(new_offerings, updated_offerings):
         repo.save_offering(o)
 
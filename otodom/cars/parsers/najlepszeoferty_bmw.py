@@ -4,13 +4,13 @@ from dataclasses import dataclass, field, replace
 from datetime import datetime
 from typing import Any, Self, TypedDict
 
-import requests as r
 from bs4 import BeautifulSoup
 from cytoolz import valfilter
 from loguru import logger
 
 from otodom.cars.model import CarOffering
 from otodom.cars.parsers.car_searcher import CarSearcher
+from otodom.http_client import get_http_client
 from otodom.util import is_not_none
 
 SEARCH_ENDPOINT = 'https://najlepszeoferty.bmw.pl/uzywane/api/v1/ems/bmw-used-pl_PL/search'
@@ -53,7 +53,7 @@ def _build_and_matcher_from_list_of_options(values: list[enum.Enum]) -> Any | Or
 
 def get_car_images_from_url(url: str) -> list[str]:
     logger.info('Fetching and parsing HTML from {}', url)
-    resp = r.get(url, timeout=10)
+    resp = get_http_client().get(url, timeout=10)
     soup = BeautifulSoup(resp.text, features='html.parser')
     elements = soup.select('.link-img')
     return [
@@ -63,6 +63,25 @@ def get_car_images_from_url(url: str) -> list[str]:
     ]
 
 
+def offering_url(record: dict) -> str:
+    return f'https://najlepszeoferty.bmw.pl/uzywane/wyszukaj/opis-szczegolowy/{record["id"]}'
+
+
+def record_to_offering(record: dict, image_urls: list[str]) -> CarOffering:
+    """Maps one record of the `$list` of the search response."""
+    return CarOffering(
+        car_document_id=str(record['id']),
+        system_updated_at=datetime.fromisoformat(record['created']),
+        model_name=record['title'],
+        image_urls=image_urls,
+        dealer_id=record['dealer']['id'],
+        gross_sales_price=record['transactionalPrice'],
+        currency='PLN',
+        electrification_type=record['fuel']['label'],
+        url=offering_url(record),
+    )
+
+
 @dataclass(frozen=True)
 class UserBmwCarsSearchRequestBuilder(CarSearcher):
     brand: Brand = Brand.BMW
@@ -194,7 +213,7 @@ class UserBmwCarsSearchRequestBuilder(CarSearcher):
     def _get_raw_search_result(self, skip: int = 0, limit: int = 23) -> dict:
         payload = self._build_search_payload(skip=skip, limit=limit)
         logger.info('Issuing search request to {}', SEARCH_ENDPOINT)
-        resp = r.post(SEARCH_ENDPOINT, json=payload, timeout=10)
+        resp = get_http_client().post(SEARCH_ENDPOINT, json=payload, timeout=10)
         if resp.status_code != http.HTTPStatus.OK:
             raise RuntimeError(
                 f'HTTP request failed with status {resp.status_code} and contents {resp.text}'
@@ -214,19 +233,7 @@ class UserBmwCarsSearchRequestBuilder(CarSearcher):
             limit = end - start
             offerings.extend(self._get_raw_search_result(skip=start, limit=limit)['$list'])
         return [
-            CarOffering(
-                car_document_id=str(o['id']),
-                system_updated_at=datetime.fromisoformat(o['created']),
-                model_name=o['title'],
-                image_urls=get_car_images_from_url(
-                    f'https://najlepszeoferty.bmw.pl/uzywane/wyszukaj/opis-szczegolowy/{o["id"]}'
-                ),
-                dealer_id=o['dealer']['id'],
-                gross_sales_price=o['transactionalPrice'],
-                currency='PLN',
-                electrification_type=o['fuel']['label'],
-                url=f'https://najlepszeoferty.bmw.pl/uzywane/wyszukaj/opis-szczegolowy/{o["id"]}',
-            )
+            record_to_offering(o, image_urls=get_car_images_from_url(offering_url(o)))
             for o in offerings
         ]
 
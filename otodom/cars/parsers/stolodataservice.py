@@ -3,12 +3,31 @@ from dataclasses import dataclass, field, replace
 from datetime import datetime
 from typing import Self
 
-import requests as r
 from loguru import logger
 
 from otodom.cars import CarSearcher
 from otodom.cars.constants import BASE_DATA_SERVICE_URL, ENGINE_ELECTRIC, ENGINE_HYBRID
 from otodom.cars.model import CarOffering
+from otodom.http_client import get_http_client
+
+
+def record_to_offering(record: dict) -> CarOffering:
+    """Maps one hit of the stock locator search response."""
+    return CarOffering(
+        car_document_id=record['vehicle']['documentId'],
+        system_updated_at=datetime.fromisoformat(record['vehicle']['internal']['updatedAt']),
+        image_urls=sorted(record['vehicle']['media']['cosyImages'].values()),
+        dealer_id=record['vehicle']['ordering']['retailData']['buNo'],
+        gross_sales_price=float(record['vehicle']['price']['grossSalesPrice']),
+        currency=record['vehicle']['price']['listPriceCurrency'],
+        model_name=record['vehicle']['vehicleSpecification']['modelAndOption']['model'][
+            'modelDescription'
+        ]['en_PL'],
+        electrification_type=record['vehicle']['vehicleSpecification']['technicalAndEmission'][
+            'technicalData'
+        ]['degreeOfElectrificationBasedFuelType'],
+        url=f'https://www.bmw.pl/pl-pl/sl/stocklocator#/details/{record["vehicle"]["documentId"]}',
+    )
 
 
 @dataclass(frozen=True)
@@ -93,7 +112,7 @@ class BmwSearchRequestBuilder(CarSearcher):
         search_payload = self._get_search_payload()
 
         logger.info('Fetching result count ...')
-        resp = r.post(
+        resp = get_http_client().post(
             str(BASE_DATA_SERVICE_URL / 'vehiclesearch/search/pl-pl/stocklocator'),
             params={
                 'maxResults': 1,
@@ -117,7 +136,7 @@ class BmwSearchRequestBuilder(CarSearcher):
             self.max_results,
         )
 
-        resp = r.post(
+        resp = get_http_client().post(
             str(BASE_DATA_SERVICE_URL / 'vehiclesearch/search/pl-pl/stocklocator'),
             params={
                 'maxResults': self.max_results,
@@ -128,26 +147,7 @@ class BmwSearchRequestBuilder(CarSearcher):
         )
         resp.raise_for_status()
 
-        return [
-            CarOffering(
-                car_document_id=record['vehicle']['documentId'],
-                system_updated_at=datetime.fromisoformat(
-                    record['vehicle']['internal']['updatedAt']
-                ),
-                image_urls=sorted(record['vehicle']['media']['cosyImages'].values()),
-                dealer_id=record['vehicle']['ordering']['retailData']['buNo'],
-                gross_sales_price=float(record['vehicle']['price']['grossSalesPrice']),
-                currency=record['vehicle']['price']['listPriceCurrency'],
-                model_name=record['vehicle']['vehicleSpecification']['modelAndOption']['model'][
-                    'modelDescription'
-                ]['en_PL'],
-                electrification_type=record['vehicle']['vehicleSpecification'][
-                    'technicalAndEmission'
-                ]['technicalData']['degreeOfElectrificationBasedFuelType'],
-                url=f'https://www.bmw.pl/pl-pl/sl/stocklocator#/details/{record["vehicle"]["documentId"]}',
-            )
-            for record in resp.json()['hits']
-        ]
+        return [record_to_offering(record) for record in resp.json()['hits']]
 
     def search_all(self) -> list[CarOffering]:
         total_count = self.search_result_count()
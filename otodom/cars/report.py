@@ -1,22 +1,16 @@
 import textwrap
+from collections.abc import Sequence
 
 from otodom.cars.model import CarOffering
+from otodom.notifications import Notification, send_notifications
 from otodom.telegram_sync import SyncBot
 
 
-def report_offering(
-    offering: CarOffering,
-    fact_message: str,
-    bot: SyncBot,
-    telegram_channel_id: str,
-):
-    # The first images is usually some placeholder, we want to avoid it.
-    bot.send_photo_from_url(telegram_channel_id, offering.image_urls[1:4])
-    bot.send_message(
-        telegram_channel_id,
-        textwrap.dedent(
+def _offering_notification(offering: CarOffering, fact_message: str) -> Notification:
+    return Notification(
+        caption=textwrap.dedent(
             f"""\
-        **{fact_message}** offering (photos 👆)
+        **{fact_message}** offering
 
         **Model**: {offering.model_name}
         **Engine type**: {offering.electrification_type}
@@ -27,5 +21,20 @@ def report_offering(
         Last update of offering at: {offering.system_updated_at}
         """
         ),
+        # The first images is usually some placeholder, we want to avoid it.
+        photo_urls=offering.image_urls[1:4],
+    )
+
+
+def report_offerings(
+    offerings: Sequence[tuple[CarOffering, str]],
+    bot: SyncBot,
+    telegram_channel_id: str,
+):
+    """Sends `(offering, fact_message)` pairs packed into captioned albums."""
+    send_notifications(
+        bot,
+        telegram_channel_id,
+        [_offering_notification(offering, fact_message) for offering, fact_message in offerings],
         parse_mode='md',
     )
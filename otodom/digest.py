@@ -0,0 +1,116 @@
+"""Digests of large batches of flats, see `otodom.report.report_new_flats`.
+
+When a filter goes live or the site reindexes, one cycle finds hundreds of flats. Above
+the digest threshold of the filter they are listed a line each in a few paginated HTML
+messages instead of a captioned photo per flat, optionally followed by every flat in one
+CSV or HTML document.
+"""
+
+import csv
+import html
+import io
+import textwrap
+from datetime import datetime
+
+from otodom.models import Flat
+from otodom.notifications import MAX_MESSAGE_LENGTH
+
+# Room left on every page for its header.
+PAGE_HEADER_RESERVE = 300
+MAX_TITLE_LENGTH = 80
+DOCUMENT_COLUMNS = ['status', 'url', 'title', 'location', 'price', 'found_ts', 'updated_ts']
+
+
+def _flat_line(flat: Flat) -> str:
+    title = textwrap.shorten(flat.title or flat.url, width=MAX_TITLE_LENGTH, placeholder='…')
+    price = f'{flat.price} PLN' if flat.price is not None else 'no price'
+    location = f', {html.escape(flat.summary_location)}' if flat.summary_location else ''
+    return f'• <a href="{html.escape(flat.url)}">{html.escape(title)}</a>, {price}{location}'
+
+
+def render_digest_pages(
+    summary: str, new_flats: list[Flat], updated_flats: list[Flat]
+) -> list[str]:
+    """Lists the flats in HTML messages, every page headed by `summary` and its number.
+
+    Pages starting in the middle of a section repeat its heading.
+    """
+    pages, page, section = [], [], None
+    page_length = 0
+    for status, flats in (('NEW', new_flats), ('UPDATED', updated_flats)):
+        for flat in flats:
+            line = _flat_line(flat)
+            if page and page_length + len(line) + 1 > MAX_MESSAGE_LENGTH - PAGE_HEADER_RESERVE:
+                pages.append(page)
+                page, page_length, section = [], 0, None
+            if section != status:
+                page.append(f'\n<b>{status}</b>')
+                page_length += len(page[-1]) + 1
+                section = status
+            page.append(line)
+            page_length += len(line) + 1
+    if page:
+        pages.append(page)
+    return [
+        '\n'.join([f'{summary}, page {idx} of {len(pages)}', *lines])
+        for idx, lines in enumerate(pages, start=1)
+    ]
+
+
+def render_digest_document(
+    filter_name: str,
+    new_flats: list[Flat],
+    updated_flats: list[Flat],
+    now: datetime,
+    attachment: str,
+) -> tuple[str, bytes]:
+    """Renders every flat into a CSV or HTML table, returns its file name and content."""
+    rows = [
+        [
+            status,
+            flat.url,
+            flat.title or '',
+            flat.summary_location or '',
+            '' if flat.price is None else str(flat.price),
+            flat.found_ts.isoformat(),
+            flat.updated_ts.isoformat() if flat.pushed_up_dt or flat.created_dt else '',
+        ]
+        for status, flats in (('new', new_flats), ('updated', updated_flats))
+        for flat in flats
+    ]
+    file_name = f'{filter_name}-{now.strftime("%Y%m%dT%H%M%S")}.{attachment}'
+    if attachment == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(DOCUMENT_COLUMNS)
+        writer.writerows(rows)
+        return file_name, buffer.getvalue().encode('utf8')
+    if attachment == 'html':
+        header = ''.join(f'<th>{column}</th>' for column in DOCUMENT_COLUMNS)
+        body = '\n'.join(
+            '<tr>'
+            + ''.join(
+                f'<td><a href="{html.escape(value)}">{html.escape(value)}</a></td>'
+                if column == 'url'
+                else f'<td>{html.escape(value)}</td>'
+                for column, value in zip(DOCUMENT_COLUMNS, row, strict=True)
+            )
+            + '</tr>'
+            for row in rows
+        )
+        document = '\n'.join(
+            [
+                '<!DOCTYPE html>',
+                '<html>',
+                f'<head><meta charset="utf-8"><title>{html.escape(file_name)}</title></head>',
+                '<body>',
+                '<table border="1">',
+                f'<tr>{header}</tr>',
+                body,
+                '</table>',
+                '</body>',
+                '</html>',
+            ]
+        )
+        return file_name, document.encode('utf8')
+    raise ValueError(f'Unknown digest attachment {attachment}, expected csv or html')
@@ -0,0 +1,196 @@
+"""Incremental export of the flats DB to Parquet or Arrow IPC files for analytics.
+
+Every export appends one part file per table to `<output>/<table>/`, so each table
+directory is a dataset readable by `pyarrow.dataset` or `pandas.read_parquet` at once.
+`<output>/watermarks.json` keeps the largest exported timestamp of every table and the
+next export only writes rows past it:
+
+    flats          memberships of listings in filters, by the time the filter found them.
+    flat_history   observed `(price, updated_at)` states, by the time they were seen;
+                   this is where changes of already exported flats show up.
+
+Rows are streamed in chunks straight from the cursor into the writer, so memory use
+depends on the chunk size only. pyarrow is imported on use: it is an optional dependency.
+"""
+
+import pathlib
+import sqlite3
+from collections.abc import Iterator
+from contextlib import closing
+from datetime import datetime
+from typing import NamedTuple
+
+import orjson
+from loguru import logger
+
+EXPORT_FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+WATERMARKS_FILE = 'watermarks.json'
+DEFAULT_CHUNK_SIZE = 50_000
+
+
+class ExportTable(NamedTuple):
+    name: str
+    # Selects the rows past the watermark, passed as the only parameter.
+    query: str
+    # Column names and their types: `string`, `int64` or `timestamp` (epoch microseconds).
+    columns: list[tuple[str, str]]
+    watermark_column: str
+
+
+EXPORT_TABLES = [
+    ExportTable(
+        name='flats',
+        query="""
+            SELECT
+                filter_membership.url,
+                filter_membership.filter_name,
+                filter_membership.found_ts,
+                filter_membership.updated_at,
+                listings.title,
+                listings.picture_url,
+                listings.summary_location,
+                listings.price
+            FROM filter_membership JOIN listings ON listings.url = filter_membership.url
+            WHERE filter_membership.found_ts > ?
+        """,
+        columns=[
+            ('url', 'string'),
+            ('filter_name', 'string'),
+            ('found_ts', 'timestamp'),
+            ('updated_at', 'timestamp'),
+            ('title', 'string'),
+            ('picture_url', 'string'),
+            ('summary_location', 'string'),
+            ('price', 'int64'),
+        ],
+        watermark_column='found_ts',
+    ),
+    ExportTable(
+        name='flat_history',
+        query='SELECT url, price, updated_at, seen_at FROM flat_history WHERE seen_at > ?',
+        columns=[
+            ('url', 'string'),
+            ('price', 'int64'),
+            ('updated_at', 'timestamp'),
+            ('seen_at', 'timestamp'),
+        ],
+        watermark_column='seen_at',
+    ),
+]
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError(
+            'Exporting needs pyarrow, install it with `pip install otodom-monitoring[export]`'
+        ) from e
+    return pa, pq
+
+
+def load_watermarks(output_path: pathlib.Path) -> dict[str, int]:
+    watermarks_file = output_path / WATERMARKS_FILE
+    if not watermarks_file.exists():
+        return {}
+    return orjson.loads(watermarks_file.read_bytes())
+
+
+def _save_watermarks(output_path: pathlib.Path, watermarks: dict[str, int]):
+    tmp_file = output_path / f'{WATERMARKS_FILE}.tmp'
+    tmp_file.write_bytes(orjson.dumps(watermarks, option=orjson.OPT_INDENT_2))
+    tmp_file.replace(output_path / WATERMARKS_FILE)
+
+
+def _iter_chunks(cur: sqlite3.Cursor, chunk_size: int) -> Iterator[list[tuple]]:
+    while rows := cur.fetchmany(chunk_size):
+        yield rows
+
+
+def _export_table(
+    conn: sqlite3.Connection,
+    table: ExportTable,
+    path: pathlib.Path,
+    fmt: str,
+    watermark: int,
+    chunk_size: int,
+) -> tuple[int, int]:
+    """Writes the rows past the watermark, returns their count and the new watermark.
+
+    The file is written under a temporary name and only renamed once complete; nothing
+    is left behind when there are no new rows.
+    """
+    pa, pq = _import_pyarrow()
+    types = {'string': pa.string(), 'int64': pa.int64(), 'timestamp': pa.timestamp('us', 'UTC')}
+    schema = pa.schema([(name, types[type_]) for name, type_ in table.columns])
+    watermark_idx = [name for name, _ in table.columns].index(table.watermark_column)
+    tmp_path = path.with_name(f'{path.name}.tmp')
+    writer = None
+    rows_total = 0
+    cur = conn.cursor()
+    with closing(cur):
+        cur.execute(table.query, [watermark])
+        try:
+            for rows in _iter_chunks(cur, chunk_size):
+                columns = list(zip(*rows, strict=True))
+                batch = pa.record_batch(
+                    [
+                        pa.array(column, type=type_)
+                        for column, type_ in zip(columns, schema.types, strict=True)
+                    ],
+                    schema=schema,
+                )
+                if writer is None:
+                    tmp_path.parent.mkdir(parents=True, exist_ok=True)
+                    if fmt == 'parquet':
+                        writer = pq.ParquetWriter(tmp_path, schema, compression='zstd')
+                    else:
+                        writer = pa.ipc.new_file(tmp_path, schema)
+                writer.write_batch(batch)
+                rows_total += len(rows)
+                watermark = max(watermark, max(columns[watermark_idx]))
+        finally:
+            if writer is not None:
+                writer.close()
+    if writer is not None:
+        tmp_path.replace(path)
+    return rows_total, watermark
+
+
+def export_flats(
+    db_file: pathlib.Path,
+    output_path: pathlib.Path,
+    fmt: str = 'parquet',
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> dict[str, int]:
+    """Exports the rows added since the previous export to `output_path`.
+
+    Reads through a read-only connection in a single transaction, so all tables are
+    exported from the same snapshot and the fetcher keeps writing meanwhile. Returns the
+    number of exported rows per table.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown export format {fmt}, expected one of {list(EXPORT_FORMATS)}')
+    output_path.mkdir(parents=True, exist_ok=True)
+    watermarks = load_watermarks(output_path)
+    part_name = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    exported = {}
+    conn = sqlite3.connect(f'{db_file.absolute().as_uri()}?mode=ro', uri=True)
+    with closing(conn):
+        conn.execute('BEGIN')
+        for table in EXPORT_TABLES:
+            rows, watermarks[table.name] = _export_table(
+                conn,
+                table,
+                output_path / table.name / f'{table.name}-{part_name}{EXPORT_FORMATS[fmt]}',
+                fmt=fmt,
+                watermark=watermarks.get(table.name, -1),
+                chunk_size=chunk_size,
+            )
+            # Saved right after the part is in place, so an interrupted export is resumed.
+            _save_watermarks(output_path, watermarks)
+            exported[table.name] = rows
+            logger.info('Exported {} rows of {} to {}', rows, table.name, output_path)
+        conn.execute('COMMIT')
+    return exported
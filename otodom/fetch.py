@@ -1,53 +1,292 @@
 import pathlib
+import sqlite3
 from collections.abc import Sequence
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from datetime import date, datetime, timedelta
+from functools import partial
+from itertools import groupby
+from operator import attrgetter
 from typing import NamedTuple
 
+from cytoolz.itertoolz import unique
 from loguru import logger
 
-from otodom.filter_parser import parse_flats_for_filter
+from otodom.archive import PayloadArchive
+from otodom.filter_parser import CrawlResult, crawl_filter
 from otodom.flat_filter import FILTERS, EstateFilter
-from otodom.listing_page_parser import LocationNotAvailableError, ParsedDataError
+from otodom.http_cache import ListingPageCache
+from otodom.http_client import get_http_client
+from otodom.listing_page_parser import (
+    LocationNotAvailableError,
+    OtodomFlatsPageParser,
+    ParsedDataError,
+)
 from otodom.models import Flat
+from otodom.query_planner import QueryGroup, plan_queries
 from otodom.report import report_error, report_new_flats
 from otodom.storage import (
     StorageContext,
+    append_flat_history,
     filter_new_estates,
+    get_last_full_sweep_ts,
     get_total_flats_in_db,
     init_storage,
-    insert_flats,
-    update_flats,
+    set_last_full_sweep_ts,
+    touch_listings,
+    transaction,
+    upsert_flats,
+    write_transaction,
 )
 from otodom.telegram_sync import SyncBot
 
+# Incremental crawls stop after this many consecutive pages without new or updated flats.
+INCREMENTAL_STOP_AFTER_KNOWN_PAGES = 2
+# Listings edited further down the results are only caught by full sweeps.
+FULL_SWEEP_INTERVAL = timedelta(hours=6)
+
 
 class FetchedFlats(NamedTuple):
     new_flats: list[Flat]
     update_flats: list[Flat]
     total_flats: int
+    # Only known after a complete crawl, otherwise empty.
+    disappeared_urls: list[str]
 
 
-def fetch_and_persist_flats(
-    storage_context: StorageContext, ts: datetime, flat_filter: EstateFilter
-):
-    filter_name = flat_filter.name
-    flats = parse_flats_for_filter(flat_filter, now=ts)
+def _has_new_or_updated_flats(
+    storage_context: StorageContext, filter_name: str, flats: list[Flat]
+) -> bool:
+    new_and_updated_estates = storage_context.writer.call(
+        filter_new_estates, flats, filter_name=filter_name
+    )
+    return bool(new_and_updated_estates.new_flats or new_and_updated_estates.updated_flats)
 
-    logger.info('Fetched {} estates', len(flats))
-    new_and_updated_estates = filter_new_estates(
-        storage_context.sqlite_conn, flats, filter_name=filter_name
+
+def _is_full_sweep_due(storage_context: StorageContext, ts: datetime, filter_name: str) -> bool:
+    last_full_sweep_ts = storage_context.writer.call(get_last_full_sweep_ts, filter_name)
+    if last_full_sweep_ts is None or ts - last_full_sweep_ts >= FULL_SWEEP_INTERVAL:
+        logger.info('Last full sweep of {} was at {}', filter_name, last_full_sweep_ts)
+        return True
+    return False
+
+
+def crawl_query_group(
+    storage_context: StorageContext,
+    ts: datetime,
+    group: QueryGroup,
+    page_cache: ListingPageCache,
+    incremental: bool = False,
+) -> CrawlResult:
+    full_sweep = not incremental or any(
+        _is_full_sweep_due(storage_context, ts, member.name) for member in group.members
+    )
+    crawl = crawl_filter(
+        group.query,
+        now=ts,
+        cache=page_cache,
+        archive=PayloadArchive(storage_context.raw_json_path),
+        members=group.members,
+        has_changes=None if full_sweep else partial(_has_new_or_updated_flats, storage_context),
+        stop_after_known_pages=INCREMENTAL_STOP_AFTER_KNOWN_PAGES,
+        # A full sweep is what catches edits the incremental crawls skipped.
+        ignore_fingerprint=full_sweep,
     )
-    logger.info('Found {} new estates', len(new_and_updated_estates.new_flats))
-    logger.info('Found {} updated estates', len(new_and_updated_estates.updated_flats))
+    logger.info(
+        'Fetched {} from {} pages, {} pages were unchanged',
+        {name: len(flats) for name, flats in crawl.flats_by_filter.items()},
+        crawl.total_pages,
+        crawl.unchanged_pages,
+    )
+    return crawl
+
+
+def persist_flats(
+    conn: sqlite3.Connection,
+    ts: datetime,
+    filter_name: str,
+    crawl: CrawlResult,
+) -> FetchedFlats:
+    flats = crawl.flats_by_filter[filter_name]
+    new_flats, updated_flats, repriced_flats, disappeared_urls = [], [], [], []
+    # Flats of unchanged pages are not parsed, but their URLs are among the seen ones.
+    if flats or crawl.complete:
+        new_and_updated_estates = filter_new_estates(
+            conn,
+            flats,
+            filter_name=filter_name,
+            seen_urls=crawl.seen_urls if crawl.complete else None,
+        )
+        new_flats = new_and_updated_estates.new_flats
+        updated_flats = new_and_updated_estates.updated_flats
+        repriced_flats = new_and_updated_estates.repriced_flats
+        disappeared_urls = new_and_updated_estates.disappeared_urls
+    logger.info('Found {} new estates for {}', len(new_flats), filter_name)
+    logger.info('Found {} updated estates for {}', len(updated_flats), filter_name)
+    if crawl.complete:
+        logger.info('{} estates disappeared from {}', len(disappeared_urls), filter_name)
 
-    insert_flats(storage_context.sqlite_conn, new_and_updated_estates.new_flats, filter_name)
-    update_flats(storage_context.sqlite_conn, new_and_updated_estates.updated_flats, filter_name)
-    total_flats = get_total_flats_in_db(storage_context.sqlite_conn, filter_name)
+    if repriced_flats:
+        logger.info('{} estates of {} changed their price', len(repriced_flats), filter_name)
+
+    # Repriced flats are not reported, but their price is stored and kept in the history.
+    changed_flats = new_flats + updated_flats + repriced_flats
+    upsert_flats(conn, changed_flats, filter_name)
+    append_flat_history(conn, changed_flats, seen_at=ts)
+    if crawl.complete:
+        set_last_full_sweep_ts(conn, filter_name, ts)
+    total_flats = get_total_flats_in_db(conn, filter_name)
     return FetchedFlats(
-        new_flats=new_and_updated_estates.new_flats,
-        update_flats=new_and_updated_estates.updated_flats,
+        new_flats=new_flats,
+        update_flats=updated_flats,
         total_flats=total_flats,
+        disappeared_urls=disappeared_urls,
+    )
+
+
+def persist_crawl(
+    conn: sqlite3.Connection,
+    ts: datetime,
+    members: Sequence[EstateFilter],
+    crawl: CrawlResult,
+    telegram_channel_id: int | None = None,
+) -> dict[str, FetchedFlats]:
+    """Persists the flats of every member filter and marks the listings seen by the crawl.
+
+    A writer job. Inside a transaction it is a savepoint, so a query failing halfway
+    leaves no partial writes behind. With `telegram_channel_id`, the report of every
+    member is queued in the outbox within the same savepoint, so it is only delivered
+    once the flats it reports are committed.
+    """
+    with transaction(conn):
+        fetched_by_member = {
+            member.name: persist_flats(conn, ts=ts, filter_name=member.name, crawl=crawl)
+            for member in members
+        }
+        touch_listings(conn, crawl.seen_urls, seen_at=ts)
+        if telegram_channel_id is not None:
+            for member in members:
+                fetched = fetched_by_member[member.name]
+                report_new_flats(
+                    conn,
+                    filter_name=member.name,
+                    new_flats=fetched.new_flats,
+                    updated_flats=fetched.update_flats,
+                    total_flats=fetched.total_flats,
+                    now=ts,
+                    report_on_no_new_flats=False,
+                    telegram_channel_id=telegram_channel_id,
+                    digest_threshold=member.digest_threshold,
+                    digest_attachment=member.digest_attachment,
+                )
+    return fetched_by_member
+
+
+def fetch_and_persist_flats(
+    storage_context: StorageContext,
+    ts: datetime,
+    flat_filter: EstateFilter,
+    incremental: bool = False,
+) -> FetchedFlats:
+    page_cache = ListingPageCache(storage_context.http_cache_path)
+    crawl = crawl_query_group(
+        storage_context,
+        ts=ts,
+        group=QueryGroup(query=flat_filter, members=[flat_filter]),
+        page_cache=page_cache,
+        incremental=incremental,
     )
+    fetched = storage_context.writer.call(persist_crawl, ts=ts, members=[flat_filter], crawl=crawl)
+    page_cache.commit()
+    return fetched[flat_filter.name]
+
+
+def replay_archive(
+    storage_context: StorageContext,
+    archive: PayloadArchive,
+    since: date | None = None,
+    until: date | None = None,
+    filter_names: Sequence[str] | None = None,
+) -> int:
+    """Feeds archived payloads through the parser and the storage diff, without network.
+
+    Pages archived by one fetch cycle of a query are replayed together as one crawl. Only
+    changed pages are archived, so this reproduces what every cycle inserted and updated,
+    but never marks a full sweep. Returns the number of replayed cycles.
+    """
+    cycles = 0
+    for (ts, query), records in groupby(
+        archive.records(since, until), key=attrgetter('ts', 'query')
+    ):
+        records = list(records)
+        members = [
+            FILTERS[name]
+            for name in records[0].members
+            if name in FILTERS and (not filter_names or name in filter_names)
+        ]
+        if not members:
+            continue
+        flats_by_filter = {member.name: [] for member in members}
+        # Like `crawl_filter`, only the members of a merged query are filtered locally.
+        merged = len(records[0].members) > 1
+        for record in records:
+            parser = OtodomFlatsPageParser(
+                payload=archive.read(record), now=ts, html='', filter=members[0]
+            )
+            try:
+                if parser.is_empty():
+                    continue
+                for member in members:
+                    flats_by_filter[member.name].extend(
+                        parser.parse(filter=member if merged else None)
+                    )
+            except (ParsedDataError, LocationNotAvailableError):
+                logger.warning(
+                    'Skipping unparseable archived {} page {} from {}', query, record.url, ts
+                )
+        crawl = CrawlResult(
+            flats_by_filter={
+                name: list(unique(flats, attrgetter('url')))
+                for name, flats in flats_by_filter.items()
+            },
+            total_pages=len(records),
+            unchanged_pages=0,
+            complete=False,
+            seen_urls=list(
+                unique(flat.url for flats in flats_by_filter.values() for flat in flats)
+            ),
+        )
+        fetched_by_member = storage_context.writer.call(
+            persist_crawl, ts=ts, members=members, crawl=crawl
+        )
+        for filter_name, fetched in fetched_by_member.items():
+            logger.info(
+                'Replayed {} cycle at {}: {} new, {} updated',
+                filter_name,
+                ts,
+                len(fetched.new_flats),
+                len(fetched.update_flats),
+            )
+        cycles += 1
+    return cycles
+
+
+def _report_failure(bot: SyncBot, telegram_channel_id: int, exception: Exception) -> bool:
+    """Reports the exception and tells whether it should fail the cycle."""
+    if isinstance(exception, LocationNotAvailableError):
+        logger.warning("Location wasn't available in parsed data, but it's usually OK.")
+        return False
+    if isinstance(exception, ParsedDataError):
+        report_error(
+            bot=bot,
+            telegram_channel_id=telegram_channel_id,
+            exception=exception,
+            context=exception.data,
+            uploaded_context_filename=exception.uploaded_filename,
+        )
+    else:
+        report_error(bot=bot, telegram_channel_id=telegram_channel_id, exception=exception)
+    return True
 
 
 def fetch_and_report(
@@ -56,7 +295,19 @@ def fetch_and_report(
     send_report: bool,
     telegram_channel_id: int,
     filters: Sequence[str],
+    incremental: bool = False,
 ):
+    """Crawls all filters concurrently, then persists and reports them at once.
+
+    Compatible filters are merged into one query by `plan_queries`. Crawls share the
+    per-host pacing of the HTTP client and only read the DB through the storage writer.
+    Once every query is crawled, all writes of the cycle go into one short transaction,
+    reports included: they are queued in the outbox table, which `OutboxSender` delivers
+    once they are committed. The page cache is only committed after that. Errors are
+    still sent right away through `bot`, after the transaction. A failing query is
+    reported and rolled back to its savepoint, and the cycle goes on with the others;
+    the first failure is re-raised once every query finished.
+    """
     if not filters:
         raise ValueError('No filters specified')
     try:
@@ -64,36 +315,73 @@ def fetch_and_report(
         storage_context = init_storage(data_path)
         ts = datetime.now()
         filters = [FILTERS[name] for name in filters]
-
-        for flat_filter in filters:
-            logger.info('Executing with {} filter', flat_filter.name)
-            fetched = fetch_and_persist_flats(
-                storage_context=storage_context, ts=ts, flat_filter=flat_filter
-            )
-
-            if send_report:
-                report_new_flats(
-                    filter_name=flat_filter.name,
-                    new_flats=fetched.new_flats,
-                    updated_flats=fetched.update_flats,
-                    total_flats=fetched.total_flats,
-                    bot=bot,
-                    now=ts,
-                    report_on_no_new_flats=False,
-                    telegram_channel_id=telegram_channel_id,
-                )
-        logger.info('Fetch for all filters completed.')
-    except ParsedDataError as e:
-        report_error(
-            bot=bot,
-            telegram_channel_id=telegram_channel_id,
-            exception=e,
-            context=e.data,
-            uploaded_context_filename=e.uploaded_filename,
-        )
-        raise e
-    except LocationNotAvailableError:
-        logger.warning("Location wasn't available in parsed data, but it's usually OK.")
     except Exception as e:
         report_error(bot=bot, telegram_channel_id=telegram_channel_id, exception=e)
         raise e
+
+    failures = []
+    groups = plan_queries(filters)
+    logger.info(
+        'Planned {} queries for {} filters: {}',
+        len(groups),
+        len(filters),
+        [group.query.name for group in groups],
+    )
+    page_caches = {
+        group.query.name: ListingPageCache(storage_context.http_cache_path) for group in groups
+    }
+
+    with closing(storage_context.writer):
+        crawls: dict[str, tuple[QueryGroup, CrawlResult]] = {}
+        with ThreadPoolExecutor(max_workers=len(groups), thread_name_prefix='query') as pool:
+            futures = {
+                pool.submit(
+                    crawl_query_group,
+                    storage_context,
+                    ts=ts,
+                    group=group,
+                    page_cache=page_caches[group.query.name],
+                    incremental=incremental,
+                ): group
+                for group in groups
+            }
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    crawls[group.query.name] = group, future.result()
+                except Exception as e:  # noqa: BLE001 -- one failing query must not stop others.
+                    logger.exception('Fetch for {} query failed', group.query.name)
+                    if _report_failure(bot, telegram_channel_id, e):
+                        failures.append(e)
+
+        persisted_queries = []
+        persist_failures = []
+        with write_transaction(storage_context):
+            for query_name, (group, crawl) in crawls.items():
+                try:
+                    storage_context.writer.call(
+                        persist_crawl,
+                        ts=ts,
+                        members=group.members,
+                        crawl=crawl,
+                        telegram_channel_id=telegram_channel_id if send_report else None,
+                    )
+                except Exception as e:  # noqa: BLE001 -- rolled back to its savepoint.
+                    logger.exception('Persisting {} query failed', query_name)
+                    persist_failures.append(e)
+                else:
+                    persisted_queries.append(query_name)
+
+    # Only now the flats and their reports are committed.
+    failures.extend(e for e in persist_failures if _report_failure(bot, telegram_channel_id, e))
+    for query_name in persisted_queries:
+        page_caches[query_name].commit()
+    logger.info(
+        'Fetch for all filters completed, {} of {} pages were served unchanged, {} queries failed.',
+        sum(crawls[query_name][1].unchanged_pages for query_name in persisted_queries),
+        sum(crawls[query_name][1].total_pages for query_name in persisted_queries),
+        len(failures),
+    )
+    get_http_client().log_metrics()
+    if failures:
+        raise failures[0]
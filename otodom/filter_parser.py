@@ -1,81 +1,309 @@
 import http
-import json
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from operator import attrgetter
-from time import sleep
+from typing import NamedTuple
 
-import requests as r
-from bs4 import BeautifulSoup
-from cytoolz.itertoolz import unique
+from cytoolz import get_in
+from cytoolz.itertoolz import concat, unique
 from loguru import logger
-from tenacity import (
-    retry,
-    retry_if_exception_type,
-    stop_after_attempt,
-    wait_exponential,
-)
+from tenacity import retry, retry_if_exception_type, stop_after_attempt
 
-from otodom.constants import USER_AGENT
+from otodom.archive import PayloadArchive
 from otodom.flat_filter import EstateFilter
+from otodom.http_cache import ListingPageCache, PageCacheEntry, content_hash, items_fingerprint
+from otodom.http_client import get_http_client
 from otodom.listing_page_parser import OtodomFlatsPageParser
 from otodom.models import Flat
+from otodom.next_data import extract_next_data
 
 PAGE_HARD_LIMIT = 100
+MAX_FETCH_WORKERS = 4
 
 
 class RetryableError(Exception):
     pass
 
 
+class ListingPage(NamedTuple):
+    url: str
+    # None when the server confirmed the cached copy with 304 Not Modified.
+    html: str | None
+    etag: str | None
+    last_modified: str | None
+
+
+class CrawlResult(NamedTuple):
+    # Flats from the pages that changed since the previous fetch, by member filter name.
+    flats_by_filter: dict[str, list[Flat]]
+    total_pages: int
+    unchanged_pages: int
+    # False when an incremental crawl stopped before the last page.
+    complete: bool
+    # Listings on all fetched pages, changed or not.
+    seen_urls: list[str]
+
+
+class _PageOutcome(NamedTuple):
+    flats_by_filter: dict[str, list[Flat]]
+    unchanged: bool
+    total_pages: int | None
+    urls: list[str]
+
+
+# No wait between attempts: the pacer of the HTTP client has already backed off the host.
 @retry(
     retry=retry_if_exception_type(RetryableError),
-    stop=stop_after_attempt(5),
-    wait=wait_exponential(5),
+    stop=stop_after_attempt(6),
 )
-def fetch_listing_html(url: str) -> str:
-    headers = {'User-Agent': USER_AGENT}
-    resp = r.get(url, headers=headers, timeout=15)
+def fetch_listing_page(url: str, cached: PageCacheEntry | None = None) -> ListingPage:
+    headers = {}
+    if cached and cached.etag:
+        headers['If-None-Match'] = cached.etag
+    if cached and cached.last_modified:
+        headers['If-Modified-Since'] = cached.last_modified
+    resp = get_http_client().get(url, headers=headers, timeout=15)
     if resp.status_code in (
+        http.HTTPStatus.TOO_MANY_REQUESTS,
+        http.HTTPStatus.FORBIDDEN,
         http.HTTPStatus.BAD_GATEWAY,
         http.HTTPStatus.SERVICE_UNAVAILABLE,
         http.HTTPStatus.GATEWAY_TIMEOUT,
         http.HTTPStatus.INTERNAL_SERVER_ERROR,
     ):
-        raise RetryableError
+        raise RetryableError(f'{resp.status_code} for {url}')
+    if cached and resp.status_code == http.HTTPStatus.NOT_MODIFIED:
+        return ListingPage(url=url, html=None, etag=cached.etag, last_modified=cached.last_modified)
     resp.raise_for_status()
-    return resp.text
+    return ListingPage(
+        url=url,
+        html=resp.text,
+        etag=resp.headers.get('ETag'),
+        last_modified=resp.headers.get('Last-Modified'),
+    )
+
 
+def fetch_listing_html(url: str) -> str:
+    return fetch_listing_page(url).html
 
-def _infer_page_count(filter: EstateFilter) -> int:
-    url = filter.with_page(1).compose_url()
-    logger.info('Inferring page count from url: {}', url)
-    html = fetch_listing_html(url)
-    soup = BeautifulSoup(html, 'html.parser')
 
-    data = json.loads(soup.find_all(attrs={'id': '__NEXT_DATA__'})[0].text)
-    return data['props']['pageProps']['data']['searchAds']['pagination']['totalPages']
+def fetch_listing_pages(
+    urls: Mapping[int, str],
+    max_workers: int = MAX_FETCH_WORKERS,
+    cached_entries: Mapping[str, PageCacheEntry | None] | None = None,
+) -> Iterator[tuple[int, ListingPage]]:
+    """Fetches pages concurrently and yields `(page_idx, page)` in completion order."""
+    cached_entries = cached_entries or {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='page-fetcher') as pool:
+        futures = {
+            pool.submit(fetch_listing_page, url, cached=cached_entries.get(url)): page_idx
+            for page_idx, url in urls.items()
+        }
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
 
 
-def parse_flats_for_filter(
+def _parse_page(
+    parser: OtodomFlatsPageParser, members: Sequence[EstateFilter]
+) -> tuple[dict[str, list[Flat]], list[str]]:
+    """Returns the flats of each member and the URLs of all listings on the page."""
+    if parser.is_empty():
+        return {member.name: [] for member in members}, []
+    # Every item is parsed, so an empty result means a broken page rather than a page
+    # where no item matched any member.
+    flats = parser.parse()
+    if not flats:
+        raise RuntimeError(
+            "Looks like there's a next page but the parser failed to parse any flats"
+        )
+    # Only members of a merged query are narrowed down locally, the query is the server's.
+    return (
+        {
+            member.name: flats if member is parser.filter else parser.parse(filter=member)
+            for member in members
+        },
+        [flat.url for flat in flats],
+    )
+
+
+def _process_page(
+    page: ListingPage,
+    cached: PageCacheEntry | None,
+    now: datetime,
+    filter: EstateFilter,
+    members: Sequence[EstateFilter],
+    cache: ListingPageCache | None,
+    archive: PayloadArchive | None,
+    ignore_fingerprint: bool = False,
+) -> _PageOutcome:
+    if page.html is None:
+        return _PageOutcome(
+            flats_by_filter={}, unchanged=True, total_pages=cached.total_pages, urls=cached.urls
+        )
+    html_hash = content_hash(page.html)
+    if cached and cached.content_hash == html_hash:
+        return _PageOutcome(
+            flats_by_filter={}, unchanged=True, total_pages=cached.total_pages, urls=cached.urls
+        )
+
+    payload = extract_next_data(page.html)
+    search_ads = get_in(['props', 'pageProps', 'data', 'searchAds'], payload)
+    fingerprint = items_fingerprint(search_ads['items']) if search_ads else None
+    total_pages = search_ads['pagination']['totalPages'] if search_ads else None
+    unchanged = bool(
+        not ignore_fingerprint
+        and cached
+        and fingerprint
+        and cached.items_fingerprint == fingerprint
+    )
+    if archive and payload and not unchanged:
+        archive.append(
+            ts=now,
+            query=filter.name,
+            url=page.url,
+            payload=payload,
+            members=[member.name for member in members],
+        )
+    flats_by_filter, urls = (
+        ({}, cached.urls)
+        if unchanged
+        else _parse_page(
+            OtodomFlatsPageParser(payload=payload, now=now, html=page.html, filter=filter),
+            members=members,
+        )
+    )
+    if cache:
+        cache.stage(
+            PageCacheEntry(
+                url=page.url,
+                etag=page.etag,
+                last_modified=page.last_modified,
+                content_hash=html_hash,
+                items_fingerprint=fingerprint,
+                total_pages=total_pages,
+                fetched_at=now,
+                urls=urls,
+            )
+        )
+    return _PageOutcome(
+        flats_by_filter=flats_by_filter, unchanged=unchanged, total_pages=total_pages, urls=urls
+    )
+
+
+def crawl_filter(
     filter: EstateFilter,
     now: datetime,
-    sleep_for: int = 3,
-) -> list[Flat]:
-    flats = []
-    page_count = _infer_page_count(filter)
+    cache: ListingPageCache | None = None,
+    archive: PayloadArchive | None = None,
+    max_workers: int = MAX_FETCH_WORKERS,
+    members: Sequence[EstateFilter] | None = None,
+    has_changes: Callable[[str, list[Flat]], bool] | None = None,
+    stop_after_known_pages: int | None = None,
+    ignore_fingerprint: bool = False,
+) -> CrawlResult:
+    """Fetches the pages of the filter and parses the ones that changed since the last fetch.
+
+    `filter` is the query sent to otodom, and `members` (the filter itself by default) are
+    evaluated locally against its items, see `otodom.query_planner`. The payloads of
+    changed pages are appended to `archive` when given.
+
+    When `has_changes` and `stop_after_known_pages` are given, the crawl is incremental:
+    results are sorted with new and bumped listings first, so pages are walked in order
+    and the crawl stops after `stop_after_known_pages` consecutive pages in which
+    `has_changes(filter_name, flats)` found nothing new or updated for any member.
+
+    With `ignore_fingerprint`, pages whose HTML changed are parsed even when their items
+    fingerprint matches the cached one; the validators are still used and staged.
+    """
+    members = members or [filter]
+    incremental = has_changes is not None and bool(stop_after_known_pages)
+
+    def is_known(outcome: _PageOutcome) -> bool:
+        return outcome.unchanged or not any(
+            flats and has_changes(name, flats) for name, flats in outcome.flats_by_filter.items()
+        )
+
+    def process(page: ListingPage) -> _PageOutcome:
+        return _process_page(
+            page,
+            cached_entries.get(page.url),
+            now=now,
+            filter=filter,
+            members=members,
+            cache=cache,
+            archive=archive,
+            ignore_fingerprint=ignore_fingerprint,
+        )
+
+    first_page_url = filter.with_page(1).compose_url()
+    logger.info('Inferring page count from url: {}', first_page_url)
+    cached_entries = {first_page_url: cache.get(first_page_url)} if cache else {}
+    first_page = fetch_listing_page(first_page_url, cached=cached_entries.get(first_page_url))
+    outcomes = {1: process(first_page)}
+    page_count = min(outcomes[1].total_pages or 1, PAGE_HARD_LIMIT)
     logger.info('Inferred that the page count is {}', page_count)
-    for page_idx in range(1, page_count + 1):
-        sleep(sleep_for)
-        url = filter.with_page(page_idx).compose_url()
-        logger.info('Querying {}', url)
-        html = fetch_listing_html(url)
-        parser = OtodomFlatsPageParser.from_html(html, now=now, filter=filter)
-        if parser.is_empty():
+
+    known_streak = int(incremental and is_known(outcomes[1]))
+    remaining = list(range(2, page_count + 1))
+    while remaining:
+        if incremental and known_streak >= stop_after_known_pages:
+            logger.info(
+                'Stopping after {} consecutive pages without changes, skipping {} pages',
+                known_streak,
+                len(remaining),
+            )
             break
-        parsed_flats = parser.parse()
-        if not parsed_flats:
-            raise RuntimeError(
-                "Looks like there's a next page but the parser failed to parse any flats"
+        # An incremental crawl only requests as many pages as could still end the streak.
+        batch_size = (
+            min(max_workers, stop_after_known_pages - known_streak)
+            if incremental
+            else len(remaining)
+        )
+        batch, remaining = remaining[:batch_size], remaining[batch_size:]
+        urls = {page_idx: filter.with_page(page_idx).compose_url() for page_idx in batch}
+        if cache:
+            cached_entries |= {url: cache.get(url) for url in urls.values()}
+        for page_idx, page in fetch_listing_pages(
+            urls, max_workers=max_workers, cached_entries=cached_entries
+        ):
+            logger.info('Fetched page {} of {}', page_idx, page_count)
+            outcomes[page_idx] = process(page)
+        if incremental:
+            for page_idx in batch:
+                known_streak = known_streak + 1 if is_known(outcomes[page_idx]) else 0
+
+    unchanged_pages = sum(outcome.unchanged for outcome in outcomes.values())
+    logger.info('{} of {} pages are unchanged since the last fetch', unchanged_pages, len(outcomes))
+    flats_by_filter = {
+        member.name: list(
+            unique(
+                concat(
+                    outcomes[page_idx].flats_by_filter.get(member.name, ())
+                    for page_idx in sorted(outcomes)
+                ),
+                attrgetter('url'),
             )
-        flats.extend(parser.parse())
-    return list(unique(flats, attrgetter('url')))
+        )
+        for member in members
+    }
+    return CrawlResult(
+        flats_by_filter=flats_by_filter,
+        total_pages=len(outcomes),
+        unchanged_pages=unchanged_pages,
+        complete=not remaining,
+        seen_urls=list(unique(concat(outcomes[page_idx].urls for page_idx in sorted(outcomes)))),
+    )
+
+
+def parse_flats_for_filter(
+    filter: EstateFilter,
+    now: datetime,
+    max_workers: int = MAX_FETCH_WORKERS,
+) -> list[Flat]:
+    crawl = crawl_filter(filter, now=now, max_workers=max_workers)
+    return crawl.flats_by_filter[filter.name]
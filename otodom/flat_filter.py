@@ -1,7 +1,11 @@
-from typing import Self
+from typing import Literal, Self
 
+from cytoolz import get_in
 from furl import furl
 
+# More new and updated flats than this in one cycle are reported as a digest.
+DEFAULT_DIGEST_THRESHOLD = 25
+
 # 'https://www.otodom.pl/pl/oferty/wynajem/mieszkanie/warszawa?distanceRadius=0&page=1&limit=36&market=ALL&ownerTypeSingleSelect=ALL&extras=[AIR_CONDITIONING]&media=[INTERNET]&buildYearMin=2010&locations=[cities_6-26]&viewType=listing&lang=pl&searchingCriteria=wynajem&searchingCriteria=mieszkanie&searchingCriteria=cala-polska'
 
 
@@ -22,6 +26,8 @@ class EstateFilter:
         self.description = []
         self.locations = []
         self.rent_type = None
+        self.digest_threshold = DEFAULT_DIGEST_THRESHOLD
+        self.digest_attachment = None
 
     def rent_a_flat(self) -> Self:
         self.rent_type = 'mieszkanie'
@@ -31,6 +37,18 @@ class EstateFilter:
         self.rent_type = 'lokal'
         return self
 
+    def with_digest(
+        self, threshold: int | None, attachment: Literal['csv', 'html'] | None = None
+    ) -> Self:
+        """Reports more than `threshold` flats of a cycle as a paginated digest.
+
+        The digest lists a flat per line instead of a captioned photo per flat and can
+        attach every flat as a CSV or HTML document. `None` reports every flat one by one.
+        """
+        self.digest_threshold = threshold
+        self.digest_attachment = attachment
+        return self
+
     def get_markdown_description(self, filter_name: str) -> str:
         options = '\n'.join(f'• {d}' for d in self.description)
         return f'Filter: `{filter_name}`\n' + options
@@ -153,7 +171,30 @@ class EstateFilter:
         return str(url)
 
     def matches_filter(self, item: dict) -> bool:
-        # return 'warszawa' in item.get('locationLabel', {}).get('value', '').lower()
+        """Checks a listing item against the constraints that can be evaluated locally.
+
+        Extras, media and build year are not part of listing items, so they are left to
+        the server. Missing values never exclude an item.
+        """
+        price = get_in(['totalPrice', 'value'], item)
+        if price is not None:
+            if self.price_min and price < self.price_min:
+                return False
+            if self.price_max and price > self.price_max:
+                return False
+        area = item.get('areaInSquareMeters')
+        if area is not None:
+            if self.area_min and area < self.area_min:
+                return False
+            if self.area_max and area > self.area_max:
+                return False
+        if self.locations:
+            locations = get_in(['location', 'reverseGeocoding', 'locations'], item) or ()
+            # Only path-like ids, e.g. `mazowieckie/warszawa/warszawa/warszawa/wola`, can be
+            # compared with the filter locations.
+            location_ids = {loc['id'] for loc in locations if '/' in (loc.get('id') or '')}
+            if location_ids and not location_ids.intersection(self.locations):
+                return False
         return True
 
 
@@ -1,13 +1,11 @@
 import datetime
-import json
+from dataclasses import dataclass
 
-import requests
-from bs4 import BeautifulSoup
 from cytoolz import get_in
 from loguru import logger
 
-from otodom.constants import USER_AGENT
-from dataclasses import dataclass
+from otodom.http_client import get_http_client
+from otodom.next_data import extract_next_data
 
 
 @dataclass(frozen=True)
@@ -27,17 +25,20 @@ class DetailFlat:
     longitude: float
 
 
-def parse_flat_page(page_url: str):
-    headers = {'User-Agent': USER_AGENT}
-    resp = requests.get(page_url, headers=headers, timeout=15)
-    html = resp.text
-    soup = BeautifulSoup(html, 'html.parser')
-    data = soup.find_all(attrs={'id': '__NEXT_DATA__'})
-    if not data:
+def parse_flat_page(page_url: str) -> DetailFlat | None:
+    resp = get_http_client().get(page_url, timeout=15)
+    return parse_flat_html(resp.text, page_url=page_url)
+
+
+def parse_flat_html(html: str, page_url: str | None = None) -> DetailFlat | None:
+    payload = extract_next_data(html)
+    if not payload:
         logger.info('Failed to extract flat from: {}', page_url)
         return None
-    payload: dict = json.loads(data[0].text)
+    return parse_flat_payload(payload)
+
 
+def parse_flat_payload(payload: dict) -> DetailFlat:
     characteristics = {
         item['key']: item for item in payload['props']['pageProps']['ad']['characteristics']
     }
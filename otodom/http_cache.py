@@ -0,0 +1,87 @@
+import hashlib
+import os
+import pathlib
+import threading
+from datetime import datetime
+
+import orjson
+from pydantic import BaseModel
+
+
+class PageCacheEntry(BaseModel):
+    url: str
+    etag: str | None
+    last_modified: str | None
+    content_hash: str
+    items_fingerprint: str | None
+    total_pages: int | None
+    fetched_at: datetime
+    # Listings on the page, which are still seen while the page stays unchanged.
+    urls: list[str] | None = None
+
+
+def content_hash(html: str) -> str:
+    return hashlib.sha256(html.encode('utf8')).hexdigest()
+
+
+# Every field a `Flat` is parsed from, so that a price change without a bump is not missed.
+FINGERPRINT_FIELDS = (
+    'id',
+    'slug',
+    'title',
+    'images',
+    'location',
+    'totalPrice',
+    'dateCreated',
+    'pushedUpAt',
+)
+
+
+def items_fingerprint(items: list[dict]) -> str:
+    """Hashes what decides whether a listing page has anything new: the parsed fields."""
+    return hashlib.sha256(
+        orjson.dumps(
+            [[item.get(field) for field in FINGERPRINT_FIELDS] for item in items],
+            option=orjson.OPT_SORT_KEYS,
+        )
+    ).hexdigest()
+
+
+class ListingPageCache:
+    """On-disk cache of listing page validators, keyed by the composed URL.
+
+    New entries are staged and only written by `commit()`, which the caller runs after
+    the flats from those pages were persisted. A crash in between therefore makes the
+    next cycle parse the pages again instead of treating them as already seen.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._staged: dict[str, PageCacheEntry] = {}
+        self._lock = threading.Lock()
+
+    def _entry_path(self, url: str) -> pathlib.Path:
+        return self.path / f'{hashlib.sha256(url.encode("utf8")).hexdigest()}.json'
+
+    def get(self, url: str) -> PageCacheEntry | None:
+        entry_path = self._entry_path(url)
+        if not entry_path.exists():
+            return None
+        entry = PageCacheEntry.model_validate_json(entry_path.read_bytes())
+        # Guards against hash collisions and entries written for a differently composed URL.
+        # Entries from before the URLs were recorded are refetched once to record them.
+        return entry if entry.url == url and entry.urls is not None else None
+
+    def stage(self, entry: PageCacheEntry):
+        with self._lock:
+            self._staged[entry.url] = entry
+
+    def commit(self):
+        with self._lock:
+            staged, self._staged = self._staged, {}
+        for url, entry in staged.items():
+            entry_path = self._entry_path(url)
+            tmp_path = entry_path.with_suffix('.tmp')
+            tmp_path.write_text(entry.model_dump_json())
+            os.replace(tmp_path, entry_path)
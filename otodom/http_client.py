@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+
+from otodom.constants import USER_AGENT
+from otodom.pacing import AdaptivePacer, parse_retry_after
+
+DEFAULT_TIMEOUT_SECONDS = 15
+DEFAULT_POOL_SIZE = 10
+# Minimal delays between requests per host, the pace listing pages were always fetched at.
+FLOOR_DELAYS_SECONDS = {'www.otodom.pl': 3.0}
+
+
+@dataclass
+class HostMetrics:
+    requests: int = 0
+    bytes_received: int = 0
+    total_latency_seconds: float = 0.0
+    statuses: Counter = field(default_factory=Counter)
+
+    @property
+    def mean_latency_seconds(self) -> float:
+        return self.total_latency_seconds / self.requests if self.requests else 0.0
+
+
+class HttpClient:
+    """A `requests.Session` with keep-alive pools per host, shared defaults and metrics.
+
+    `Accept-Encoding` always offers gzip and deflate, and also brotli whenever a brotli
+    decoder is importable, because urllib3 can only decode what is installed.
+
+    With a `pacer`, every request first waits for its host's slot and then reports its
+    status, latency and `Retry-After` back, so all scrapers of a host back off together.
+    """
+
+    def __init__(
+        self,
+        timeout: float = DEFAULT_TIMEOUT_SECONDS,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        headers: dict[str, str] | None = None,
+        pacer: AdaptivePacer | None = None,
+    ):
+        self.timeout = timeout
+        self.pacer = pacer
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(
+            {'User-Agent': USER_AGENT, **make_headers(accept_encoding=True), **(headers or {})}
+        )
+        self._metrics: dict[str, HostMetrics] = {}
+        self._metrics_lock = threading.Lock()
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        if self.pacer:
+            self.pacer.wait(url)
+        started_at = time.perf_counter()
+        try:
+            resp = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            if self.pacer:
+                self.pacer.observe(url, None, time.perf_counter() - started_at)
+            raise
+        latency = time.perf_counter() - started_at
+        if self.pacer:
+            retry_after = (
+                parse_retry_after(resp.headers.get('Retry-After'))
+                if resp.status_code >= 400
+                else None
+            )
+            self.pacer.observe(url, resp.status_code, latency, retry_after)
+        # Streamed bodies are not read yet, so only their advertised length is known.
+        bytes_received = (
+            int(resp.headers.get('Content-Length', 0)) if kwargs.get('stream') else resp.raw.tell()
+        )
+        self._record(urlsplit(url).netloc, resp.status_code, latency, bytes_received)
+        logger.debug(
+            '{} {} -> {} in {:.3f}s, {} bytes',
+            method,
+            url,
+            resp.status_code,
+            latency,
+            bytes_received,
+        )
+        return resp
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def _record(self, host: str, status: int, latency: float, bytes_received: int):
+        with self._metrics_lock:
+            metrics = self._metrics.setdefault(host, HostMetrics())
+            metrics.requests += 1
+            metrics.bytes_received += bytes_received
+            metrics.total_latency_seconds += latency
+            metrics.statuses[status] += 1
+
+    def metrics(self) -> dict[str, HostMetrics]:
+        with self._metrics_lock:
+            return {
+                host: HostMetrics(
+                    requests=m.requests,
+                    bytes_received=m.bytes_received,
+                    total_latency_seconds=m.total_latency_seconds,
+                    statuses=Counter(m.statuses),
+                )
+                for host, m in self._metrics.items()
+            }
+
+    def log_metrics(self):
+        for host, m in sorted(self.metrics().items()):
+            logger.info(
+                'HTTP {}: {} requests, {} bytes, mean latency {:.3f}s, statuses {}',
+                host,
+                m.requests,
+                m.bytes_received,
+                m.mean_latency_seconds,
+                dict(m.statuses),
+            )
+        if self.pacer:
+            for host, delay in sorted(self.pacer.current_delays().items()):
+                logger.info('Pacing {}: {:.1f}s between requests', host, delay)
+
+    def close(self):
+        self.session.close()
+
+
+_default_client: HttpClient | None = None
+_default_client_lock = threading.Lock()
+
+
+def get_http_client() -> HttpClient:
+    """Returns the process-wide client, so every scraper shares the same connection pools."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HttpClient(pacer=AdaptivePacer(floor_delays=FLOOR_DELAYS_SECONDS))
+        return _default_client
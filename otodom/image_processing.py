@@ -0,0 +1,64 @@
+"""Optional downscaling and re-encoding of photos before they are uploaded to Telegram.
+
+Listing photos come at their original size, car photos often at several megapixels,
+while Telegram shows them at most 1280 pixels wide. `ImageProcessor` shrinks every
+downloaded photo to `max_edge` and re-encodes it as a JPEG of `quality`, right in the
+download worker that fetched it, so the event loop of the bot never waits for the CPU.
+Pillow releases the GIL while decoding, resizing and encoding, so the download workers
+process photos in parallel. Pillow is imported on use: it is an optional dependency.
+"""
+
+import pathlib
+
+from loguru import logger
+
+DEFAULT_JPEG_QUALITY = 80
+
+
+def _import_pillow():
+    try:
+        from PIL import Image, ImageOps
+    except ImportError as e:
+        raise RuntimeError(
+            'Resizing photos needs Pillow, install it with `pip install otodom-monitoring[images]`'
+        ) from e
+    return Image, ImageOps
+
+
+class ImageProcessor:
+    def __init__(self, max_edge: int, quality: int = DEFAULT_JPEG_QUALITY):
+        # Fails at startup rather than on the first photo.
+        _import_pillow()
+        self.max_edge = max_edge
+        self.quality = quality
+
+    @property
+    def variant(self) -> str:
+        """Tells the processed photos apart from the photos processed with other settings."""
+        return f'{self.max_edge}px-q{self.quality}'
+
+    def shrink(self, source: pathlib.Path, target: pathlib.Path) -> pathlib.Path:
+        """Writes the processed photo to `target` and removes `source`.
+
+        Returns the file to keep: `source` itself when processing fails or does not make
+        the photo any smaller.
+        """
+        Image, ImageOps = _import_pillow()
+        try:
+            with Image.open(source) as image:
+                # Phones store the orientation in EXIF, which is lost on re-encoding.
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((self.max_edge, self.max_edge))
+                if image.mode != 'RGB':
+                    image = image.convert('RGB')
+                image.save(target, 'JPEG', quality=self.quality, optimize=True, progressive=True)
+        except (OSError, Image.DecompressionBombError) as e:
+            logger.warning('Uploading {} as it is, it cannot be processed: {}', source, e)
+            target.unlink(missing_ok=True)
+            return source
+        if target.stat().st_size >= source.stat().st_size:
+            # Already small and well compressed.
+            target.unlink()
+            return source
+        source.unlink()
+        return target
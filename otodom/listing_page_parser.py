@@ -1,16 +1,15 @@
 import base64
-import json
 import re
 from datetime import datetime
 from operator import itemgetter
 from typing import Self
 
 import pytz
-from bs4 import BeautifulSoup
 from cytoolz import concat, unique
 
 from otodom.flat_filter import EstateFilter
 from otodom.models import Flat
+from otodom.next_data import extract_next_data
 
 PRICE_RE = re.compile(r'([0-9 ]+)\szł/mc')
 
@@ -54,27 +53,33 @@ class LocationNotAvailableError(Exception):
 
 
 class OtodomFlatsPageParser:
-    def __init__(self, soup: BeautifulSoup, now: datetime, html: str, filter: EstateFilter):
-        self.soup = soup
+    def __init__(self, payload: dict | None, now: datetime, html: str, filter: EstateFilter):
+        self.payload = payload
         self.now = now
         self.html = html
         self.filter = filter
 
     @classmethod
     def from_html(cls, html: str, now: datetime, filter: EstateFilter) -> Self:
-        soup = BeautifulSoup(html, 'html.parser')
-        return cls(soup=soup, now=now, html=html, filter=filter)
+        return cls(payload=extract_next_data(html), now=now, html=html, filter=filter)
 
     def is_empty(self) -> bool:
-        return bool(self.soup.find_all(attrs={'data-cy': 'no-search-results'}))
-
-    def parse(self) -> list[Flat]:
-        data = self.soup.find_all(attrs={'id': '__NEXT_DATA__'})
-        if not data:
+        if not self.payload:
+            return False
+        data = self.payload['props']['pageProps']['data']
+        return bool(data) and not data['searchAds']['items']
+
+    def parse(self, filter: EstateFilter | None = None) -> list[Flat]:
+        """Parses the flats on the page, only the ones `filter` matches locally if given.
+
+        The page is the result of the server-side query, so its own filter is not applied
+        again: the local checks only tell apart the members of a merged query.
+        """
+        if self.payload is None:
             raise RuntimeError(
                 f'Failed to fetch data from from html: base64 {base64.b64encode(self.html.encode("utf8"))}'
             )
-        payload: dict = json.loads(data[0].text)
+        payload = self.payload
         data = payload['props']['pageProps']['data']
         if not data:
             context = payload | {'__html': self.html}
@@ -95,7 +100,7 @@ class OtodomFlatsPageParser:
         )
         flats = []
         for item in items:
-            if not self.filter.matches_filter(item):
+            if filter is not None and not filter.matches_filter(item):
                 continue
             flats.append(
                 Flat(
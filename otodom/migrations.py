@@ -0,0 +1,410 @@
+"""Versioned schema of the flats DB.
+
+`PRAGMA user_version` holds the number of applied migrations. Every migration runs in
+its own transaction together with the version bump, so an interrupted migration is
+simply retried on the next start. Migrations spell out table names instead of using
+the constants of `otodom.storage`: they describe the schema as it was at the time.
+"""
+
+import sqlite3
+from collections.abc import Callable, Sequence
+from datetime import datetime
+
+from loguru import logger
+
+from otodom.util import dt_to_epoch_us
+
+Migration = Callable[[sqlite3.Connection], None]
+
+
+def _initial_schema(conn: sqlite3.Connection):
+    # DBs created before versioning already have these tables.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS flats (
+            url text not null,
+            found_ts text,
+            title text,
+            picture_url text,
+            summary_location text,
+            price INTEGER,
+            updated_at text,
+            filter_name text not null,
+            PRIMARY KEY (url, filter_name)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS crawl_state (
+            filter_name text not null PRIMARY KEY,
+            last_full_sweep_ts text
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS flat_history (
+            url text not null,
+            price INTEGER,
+            updated_at text not null,
+            seen_at text not null,
+            PRIMARY KEY (url, updated_at, price)
+        )
+        """
+    )
+
+
+def _filter_index_and_counters(conn: sqlite3.Connection):
+    # Serves the scans by filter: disappeared flats, counts and reporting queries.
+    conn.execute('CREATE INDEX IF NOT EXISTS flats_filter_name_url ON flats (filter_name, url)')
+    conn.execute(
+        """
+        CREATE TABLE filter_counters (
+            filter_name text not null PRIMARY KEY,
+            total_flats INTEGER not null
+        )
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO filter_counters (filter_name, total_flats)
+        SELECT filter_name, COUNT(*) FROM flats GROUP BY filter_name
+        """
+    )
+    # Triggers keep the counters in the transaction of whatever writes the flats.
+    conn.execute(
+        """
+        CREATE TRIGGER flats_count_insert AFTER INSERT ON flats
+        BEGIN
+            INSERT INTO filter_counters (filter_name, total_flats) VALUES (new.filter_name, 1)
+            ON CONFLICT (filter_name) DO UPDATE SET total_flats = total_flats + 1;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER flats_count_delete AFTER DELETE ON flats
+        BEGIN
+            UPDATE filter_counters SET total_flats = total_flats - 1
+            WHERE filter_name = old.filter_name;
+        END
+        """
+    )
+
+
+def _normalized_listings(conn: sqlite3.Connection):
+    # One row per listing with its latest content, and the first time any filter found it.
+    conn.execute(
+        """
+        CREATE TABLE listings (
+            url text not null PRIMARY KEY,
+            found_ts text,
+            title text,
+            picture_url text,
+            summary_location text,
+            price INTEGER,
+            updated_at text
+        )
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO listings
+            (url, found_ts, title, picture_url, summary_location, price, updated_at)
+        SELECT url, first_found_ts, title, picture_url, summary_location, price, updated_at
+        FROM (
+            SELECT
+                *,
+                MIN(found_ts) OVER (PARTITION BY url) AS first_found_ts,
+                ROW_NUMBER() OVER (PARTITION BY url ORDER BY updated_at DESC) AS recency
+            FROM flats
+        )
+        WHERE recency = 1
+        """
+    )
+    # What each filter has seen of a listing, which is what its reports are diffed against.
+    conn.execute(
+        """
+        CREATE TABLE filter_membership (
+            url text not null,
+            filter_name text not null,
+            found_ts text,
+            updated_at text,
+            PRIMARY KEY (url, filter_name)
+        )
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO filter_membership (url, filter_name, found_ts, updated_at)
+        SELECT url, filter_name, found_ts, updated_at FROM flats
+        """
+    )
+    # Also drops the index and the counter triggers of the table.
+    conn.execute('DROP TABLE flats')
+    conn.execute(
+        """
+        CREATE INDEX filter_membership_filter_name_url ON filter_membership (filter_name, url)
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER filter_membership_count_insert AFTER INSERT ON filter_membership
+        BEGIN
+            INSERT INTO filter_counters (filter_name, total_flats) VALUES (new.filter_name, 1)
+            ON CONFLICT (filter_name) DO UPDATE SET total_flats = total_flats + 1;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER filter_membership_count_delete AFTER DELETE ON filter_membership
+        BEGIN
+            UPDATE filter_counters SET total_flats = total_flats - 1
+            WHERE filter_name = old.filter_name;
+        END
+        """
+    )
+    # Keeps ad-hoc queries against the old table working.
+    conn.execute(
+        """
+        CREATE VIEW flats AS
+        SELECT
+            listings.url,
+            filter_membership.found_ts,
+            listings.title,
+            listings.picture_url,
+            listings.summary_location,
+            listings.price,
+            filter_membership.updated_at,
+            filter_membership.filter_name
+        FROM filter_membership JOIN listings ON listings.url = filter_membership.url
+        """
+    )
+
+
+def _iso_to_epoch_us(value: str | None) -> int | None:
+    return dt_to_epoch_us(datetime.fromisoformat(value)) if value else None
+
+
+def _rebuild_table(conn: sqlite3.Connection, table: str, schema: str, select: str):
+    conn.execute(f'CREATE TABLE {table}_rebuilt ({schema})')
+    conn.execute(f'INSERT INTO {table}_rebuilt {select}')
+    conn.execute(f'DROP TABLE {table}')
+    conn.execute(f'ALTER TABLE {table}_rebuilt RENAME TO {table}')
+
+
+def _integer_timestamps(conn: sqlite3.Connection):
+    # Timestamps become microseconds since the epoch: compact, indexable and compared
+    # without parsing. Text is converted in Python, as SQLite date functions round it.
+    conn.create_function('iso_to_epoch_us', 1, _iso_to_epoch_us, deterministic=True)
+    conn.execute('DROP VIEW flats')
+    _rebuild_table(
+        conn,
+        'listings',
+        """
+            url text not null PRIMARY KEY,
+            found_ts INTEGER,
+            title text,
+            picture_url text,
+            summary_location text,
+            price INTEGER,
+            updated_at INTEGER
+        """,
+        """
+        SELECT url, iso_to_epoch_us(found_ts), title, picture_url, summary_location, price,
+            iso_to_epoch_us(updated_at)
+        FROM listings
+        """,
+    )
+    _rebuild_table(
+        conn,
+        'filter_membership',
+        """
+            url text not null,
+            filter_name text not null,
+            found_ts INTEGER,
+            updated_at INTEGER,
+            PRIMARY KEY (url, filter_name)
+        """,
+        """
+        SELECT url, filter_name, iso_to_epoch_us(found_ts), iso_to_epoch_us(updated_at)
+        FROM filter_membership
+        """,
+    )
+    _rebuild_table(
+        conn,
+        'flat_history',
+        """
+            url text not null,
+            price INTEGER,
+            updated_at INTEGER not null,
+            seen_at INTEGER not null,
+            PRIMARY KEY (url, updated_at, price)
+        """,
+        """
+        SELECT url, price, iso_to_epoch_us(updated_at), iso_to_epoch_us(seen_at)
+        FROM flat_history
+        """,
+    )
+    _rebuild_table(
+        conn,
+        'crawl_state',
+        """
+            filter_name text not null PRIMARY KEY,
+            last_full_sweep_ts INTEGER
+        """,
+        'SELECT filter_name, iso_to_epoch_us(last_full_sweep_ts) FROM crawl_state',
+    )
+    # Dropping the old filter_membership table dropped its index and triggers too.
+    conn.execute(
+        """
+        CREATE INDEX filter_membership_filter_name_url ON filter_membership (filter_name, url)
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER filter_membership_count_insert AFTER INSERT ON filter_membership
+        BEGIN
+            INSERT INTO filter_counters (filter_name, total_flats) VALUES (new.filter_name, 1)
+            ON CONFLICT (filter_name) DO UPDATE SET total_flats = total_flats + 1;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER filter_membership_count_delete AFTER DELETE ON filter_membership
+        BEGIN
+            UPDATE filter_counters SET total_flats = total_flats - 1
+            WHERE filter_name = old.filter_name;
+        END
+        """
+    )
+    # The view still shows ISO text, at millisecond precision, for ad-hoc queries.
+    conn.execute(
+        """
+        CREATE VIEW flats AS
+        SELECT
+            listings.url,
+            strftime('%Y-%m-%dT%H:%M:%f', filter_membership.found_ts / 1e6, 'unixepoch')
+                AS found_ts,
+            listings.title,
+            listings.picture_url,
+            listings.summary_location,
+            listings.price,
+            strftime('%Y-%m-%dT%H:%M:%f', filter_membership.updated_at / 1e6, 'unixepoch')
+                AS updated_at,
+            filter_membership.filter_name
+        FROM filter_membership JOIN listings ON listings.url = filter_membership.url
+        """
+    )
+
+
+def _listing_last_seen(conn: sqlite3.Connection):
+    # When a listing was last on any fetched page, which retention archives listings by.
+    # History rows only record changes, so listings are taken as seen now: the complete
+    # crawls after the upgrade find the ones that are gone before retention archives them.
+    conn.execute('ALTER TABLE listings ADD COLUMN last_seen_at INTEGER')
+    conn.execute('UPDATE listings SET last_seen_at = ?', (dt_to_epoch_us(datetime.now()),))
+    conn.execute('CREATE INDEX listings_last_seen_at ON listings (last_seen_at)')
+
+
+def _flat_history_null_prices(conn: sqlite3.Connection):
+    # NULL prices are distinct in a primary key, so their states were never deduplicated.
+    _rebuild_table(
+        conn,
+        'flat_history',
+        """
+            url text not null,
+            price INTEGER,
+            updated_at INTEGER not null,
+            seen_at INTEGER not null
+        """,
+        """
+        SELECT url, price, updated_at, MIN(seen_at)
+        FROM flat_history
+        GROUP BY url, updated_at, price
+        """,
+    )
+    # Prices are never negative, so -1 stands for a missing price.
+    conn.execute(
+        """
+        CREATE UNIQUE INDEX flat_history_state
+        ON flat_history (url, updated_at, COALESCE(price, -1))
+        """
+    )
+
+
+def _telegram_outbox(conn: sqlite3.Connection):
+    # Reports are queued in the transaction of the flats they report, see `otodom.outbox`.
+    conn.execute(
+        """
+        CREATE TABLE telegram_outbox (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER not null,
+            text text,
+            parse_mode text not null,
+            photo_urls text not null,
+            captions text not null DEFAULT '[]',
+            document_name text,
+            document BLOB,
+            created_at INTEGER not null,
+            next_attempt_at INTEGER not null,
+            attempts INTEGER not null DEFAULT 0,
+            text_sent INTEGER not null DEFAULT 0,
+            sent_at INTEGER,
+            failed_at INTEGER,
+            last_error text
+        )
+        """
+    )
+    # Only undelivered messages are ever looked up.
+    conn.execute(
+        """
+        CREATE INDEX telegram_outbox_pending ON telegram_outbox (next_attempt_at)
+        WHERE sent_at IS NULL AND failed_at IS NULL
+        """
+    )
+
+
+MIGRATIONS: list[Migration] = [
+    _initial_schema,
+    _filter_index_and_counters,
+    _normalized_listings,
+    _integer_timestamps,
+    _listing_last_seen,
+    _flat_history_null_prices,
+    _telegram_outbox,
+]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def pending_migrations(conn: sqlite3.Connection) -> list[Migration]:
+    return MIGRATIONS[get_schema_version(conn) :]
+
+
+def migrate(conn: sqlite3.Connection, migrations: Sequence[Migration] = MIGRATIONS) -> int:
+    """Applies the pending migrations and returns the resulting schema version.
+
+    Other DBs pass their own list of `migrations`.
+    """
+    version = get_schema_version(conn)
+    if version > len(migrations):
+        raise RuntimeError(
+            f'The DB schema version {version} is newer than the latest known {len(migrations)}'
+        )
+    for target_version, migration in enumerate(migrations[version:], start=version + 1):
+        logger.info('Migrating the DB schema to version {}: {}', target_version, migration.__name__)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {target_version}')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+    return len(migrations)
@@ -0,0 +1,31 @@
+import re
+
+import orjson
+
+# Matches the opening tag only; the payload runs until the next `</script>`, which
+# cannot appear inside the JSON because Next.js escapes `</` in serialized props.
+_NEXT_DATA_OPENING_TAG_RE = re.compile(r'<script[^>]*\sid=["\']?__NEXT_DATA__["\']?[^>]*>')
+_SCRIPT_CLOSING_TAG = '</script>'
+
+
+def find_next_data_payload(html: str) -> str | None:
+    """Returns the raw JSON text of `<script id="__NEXT_DATA__">` without building a DOM."""
+    # A plain substring search lets the regex start right next to the tag instead of
+    # scanning the whole document. The marker may also show up in inline scripts, hence
+    # the loop over its occurrences.
+    marker = html.find('__NEXT_DATA__')
+    while marker != -1:
+        tag_start = html.rfind('<script', 0, marker)
+        opening_tag = _NEXT_DATA_OPENING_TAG_RE.match(html, tag_start) if tag_start != -1 else None
+        if opening_tag and opening_tag.end() > marker:
+            payload_end = html.find(_SCRIPT_CLOSING_TAG, opening_tag.end())
+            return html[opening_tag.end() : payload_end] if payload_end != -1 else None
+        marker = html.find('__NEXT_DATA__', marker + 1)
+    return None
+
+
+def extract_next_data(html: str) -> dict | None:
+    payload = find_next_data_payload(html)
+    if payload is None:
+        return None
+    return orjson.loads(payload)
@@ -0,0 +1,110 @@
+"""Renders report items into as few Telegram calls as possible.
+
+Every item is a caption with its photos. It goes out as a media group captioned on its
+first photo instead of a text message followed by the photos. Consecutive items share one
+album while it has at most `MAX_ALBUM_PHOTOS` photos and their captions, joined in the
+order of the photos, fit into one caption: clients only show the caption of an album when
+a single photo carries it. Consecutive items without photos are joined into text
+messages instead, and an item with a caption over the Telegram limit for captions is sent
+as its text followed by its own uncaptioned photos.
+"""
+
+from collections.abc import Iterable
+from typing import Literal, NamedTuple
+
+from otodom.telegram_sync import SyncBot
+
+MAX_ALBUM_PHOTOS = 10
+# Telegram limits the length of the parsed text; the raw markup is longer, so this is safe.
+MAX_CAPTION_LENGTH = 1024
+MAX_MESSAGE_LENGTH = 4096
+MESSAGE_SEPARATOR = '\n\n'
+
+
+class Notification(NamedTuple):
+    caption: str
+    photo_urls: list[str]
+
+
+class TelegramCall(NamedTuple):
+    """A text message, an album captioned per photo, or a text followed by its photos."""
+
+    text: str | None
+    photo_urls: list[str]
+    captions: list[str]
+
+
+def _pack_texts(texts: list[str]) -> list[TelegramCall]:
+    calls, message = [], ''
+    for text in texts:
+        if message and len(message) + len(MESSAGE_SEPARATOR) + len(text) > MAX_MESSAGE_LENGTH:
+            calls.append(TelegramCall(text=message, photo_urls=[], captions=[]))
+            message = ''
+        message = f'{message}{MESSAGE_SEPARATOR}{text}' if message else text
+    if message:
+        calls.append(TelegramCall(text=message, photo_urls=[], captions=[]))
+    return calls
+
+
+def _album(photo_urls: list[str], caption: str) -> TelegramCall:
+    return TelegramCall(
+        text=None, photo_urls=photo_urls, captions=[caption] + [''] * (len(photo_urls) - 1)
+    )
+
+
+def render_notifications(notifications: Iterable[Notification]) -> list[TelegramCall]:
+    """Packs the notifications, in order, into text messages and albums.
+
+    The photos of one item are never split between albums; an item is cut to
+    `MAX_ALBUM_PHOTOS` photos instead.
+    """
+    calls, texts = [], []
+    photo_urls, caption = [], ''
+    for notification in notifications:
+        photos = notification.photo_urls[:MAX_ALBUM_PHOTOS]
+        # Whatever is buffered for the other kind of call goes first, to keep the order.
+        if not photos:
+            if photo_urls:
+                calls.append(_album(photo_urls, caption))
+                photo_urls, caption = [], ''
+            texts.append(notification.caption)
+            continue
+        calls.extend(_pack_texts(texts))
+        texts = []
+        if len(notification.caption) > MAX_CAPTION_LENGTH:
+            if photo_urls:
+                calls.append(_album(photo_urls, caption))
+                photo_urls, caption = [], ''
+            calls.append(
+                TelegramCall(
+                    text=notification.caption, photo_urls=photos, captions=[''] * len(photos)
+                )
+            )
+            continue
+        joined_caption = MESSAGE_SEPARATOR.join(filter(None, [caption, notification.caption]))
+        if photo_urls and (
+            len(photo_urls) + len(photos) > MAX_ALBUM_PHOTOS
+            or len(joined_caption) > MAX_CAPTION_LENGTH
+        ):
+            calls.append(_album(photo_urls, caption))
+            photo_urls, joined_caption = [], notification.caption
+        photo_urls = photo_urls + photos
+        caption = joined_caption
+    calls.extend(_pack_texts(texts))
+    if photo_urls:
+        calls.append(_album(photo_urls, caption))
+    return calls
+
+
+def send_notifications(
+    bot: SyncBot,
+    chat_id: int | str,
+    notifications: Iterable[Notification],
+    parse_mode: Literal['md', 'html'],
+):
+    """Renders and sends the notifications right away, bypassing the outbox."""
+    for call in render_notifications(notifications):
+        if call.text:
+            bot.send_message(chat_id, call.text, parse_mode=parse_mode)
+        if call.photo_urls:
+            bot.send_album(chat_id, call.photo_urls, call.captions, parse_mode=parse_mode)
@@ -0,0 +1,398 @@
+"""Durable outbox of Telegram messages, delivered in order in the background.
+
+Reports are queued in the `telegram_outbox` table of the flats DB by `enqueue`, a writer
+job running in the same transaction as the flats they report: a cycle that rolls back
+or dies before its COMMIT leaves no reports behind, and the next cycle finds the flats
+again. `OutboxSender` drains the committed messages on the event loop of the bot.
+Undelivered messages survive restarts and are sent by the next process.
+"""
+
+import asyncio
+import pathlib
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing, suppress
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Literal, NamedTuple
+
+import orjson
+from loguru import logger
+from telethon.errors import FloodWaitError
+
+from otodom.migrations import migrate
+from otodom.storage import SQLITE_PRAGMAS, transaction
+from otodom.telegram_sync import SyncBot, send_album
+from otodom.util import dt_to_epoch_us
+
+OUTBOX_TABLE = 'telegram_outbox'
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_MAX_ATTEMPTS = 8
+# Retries wait `BACKOFF_BASE * 2 ** (attempts - 1)`, capped, with up to a tenth of jitter.
+BACKOFF_BASE = timedelta(seconds=5)
+BACKOFF_MAX = timedelta(minutes=30)
+POLL_INTERVAL_SECONDS = 1.0
+# Delivered and abandoned messages are kept this long for troubleshooting.
+DELIVERED_RETENTION = timedelta(days=7)
+# How long a one-off run waits for its reports before leaving them to the next run.
+DEFAULT_FLUSH_TIMEOUT = timedelta(minutes=10)
+
+
+class OutboxMessage(NamedTuple):
+    id: int
+    chat_id: int
+    text: str | None
+    parse_mode: Literal['md', 'html']
+    photo_urls: list[str]
+    # One per photo, empty for the photos without a caption.
+    captions: list[str]
+    # A file sent as a document, captioned with the text.
+    document_name: str | None
+    document: bytes | None
+    # The text went out already, only the photos are left.
+    text_sent: bool
+    attempts: int
+
+
+def get_legacy_outbox_db_file(base_data_path: pathlib.Path) -> pathlib.Path:
+    # The outbox used to be a DB of its own, see `TelegramOutbox`.
+    return base_data_path / 'data' / 'sqlite' / 'outbox.db'
+
+
+def enqueue(
+    conn: sqlite3.Connection,
+    chat_id: int,
+    text: str | None,
+    parse_mode: Literal['md', 'html'] = 'html',
+    photo_urls: list[str] | None = None,
+    captions: list[str] | None = None,
+    document: tuple[str, bytes] | None = None,
+) -> int:
+    """Queues a message; `document` is a file name and the content to send with it.
+
+    A writer job: the message is only delivered once the transaction around it commits.
+    """
+    photo_urls = photo_urls or []
+    captions = captions or [''] * len(photo_urls)
+    if len(captions) != len(photo_urls):
+        raise ValueError(f'Got {len(captions)} captions for {len(photo_urls)} photos')
+    if document is not None and photo_urls:
+        raise ValueError('A document cannot be sent together with photos')
+    document_name, document_content = document or (None, None)
+    now_us = dt_to_epoch_us(datetime.now())
+    cur = conn.execute(
+        f"""
+        INSERT INTO {OUTBOX_TABLE}
+            (chat_id, text, parse_mode, photo_urls, captions, document_name, document,
+             created_at, next_attempt_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            chat_id,
+            text,
+            parse_mode,
+            orjson.dumps(photo_urls),
+            orjson.dumps(captions),
+            document_name,
+            document_content,
+            now_us,
+            now_us,
+        ],
+    )
+    return cur.lastrowid
+
+
+def _import_legacy_outbox(conn: sqlite3.Connection, legacy_path: pathlib.Path):
+    """Moves the undelivered messages of the former outbox DB over, then deletes it."""
+    conn.execute('ATTACH DATABASE ? AS legacy', [str(legacy_path)])
+    try:
+        with transaction(conn):
+            moved = conn.execute(
+                f"""
+                INSERT INTO {OUTBOX_TABLE}
+                    (chat_id, text, parse_mode, photo_urls, captions, document_name, document,
+                     created_at, next_attempt_at, attempts, text_sent, last_error)
+                SELECT
+                    chat_id, text, parse_mode, photo_urls, captions, document_name, document,
+                    created_at, next_attempt_at, attempts, text_sent, last_error
+                FROM legacy.{OUTBOX_TABLE}
+                WHERE sent_at IS NULL AND failed_at IS NULL
+                ORDER BY id
+                """
+            ).rowcount
+    finally:
+        conn.execute('DETACH DATABASE legacy')
+    logger.info('Moved {} undelivered messages over from {}', moved, legacy_path)
+    for suffix in ('', '-wal', '-shm'):
+        pathlib.Path(f'{legacy_path}{suffix}').unlink(missing_ok=True)
+
+
+class TelegramOutbox:
+    """Delivery state of the outbox table in the flats DB, safe to use from any thread.
+
+    Every message is a text and/or an album of captioned photos for one chat, see
+    `otodom.notifications.TelegramCall`, or a document captioned with the text. The text
+    goes first, and once it is delivered only the photos are retried. Messages are queued
+    by `enqueue`, in the transaction of the flats they report.
+    """
+
+    def __init__(self, path: pathlib.Path, legacy_path: pathlib.Path | None = None):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        for pragma, value in SQLITE_PRAGMAS.items():
+            self._conn.execute(f'PRAGMA {pragma} = {value}')
+        migrate(self._conn)
+        if legacy_path is not None and legacy_path.exists():
+            _import_legacy_outbox(self._conn, legacy_path)
+        self._lock = threading.Lock()
+
+    def due(
+        self, now: datetime, limit: int, exclude_chats: set[int] = frozenset()
+    ) -> list[OutboxMessage]:
+        """The oldest undelivered message of each chat, if its next attempt is due.
+
+        Messages of a chat are delivered strictly in order: while the oldest one waits
+        for a retry, the later ones wait as well.
+        """
+        with self._lock, closing(self._conn.cursor()) as cur:
+            rows = cur.execute(
+                f"""
+                SELECT
+                    id, chat_id, text, parse_mode, photo_urls, captions, document_name, document,
+                    text_sent, attempts
+                FROM {OUTBOX_TABLE} AS message
+                WHERE sent_at IS NULL AND failed_at IS NULL AND next_attempt_at <= ?
+                    AND id = (
+                        SELECT MIN(id) FROM {OUTBOX_TABLE} AS earlier
+                        WHERE earlier.chat_id = message.chat_id
+                            AND earlier.sent_at IS NULL AND earlier.failed_at IS NULL
+                    )
+                ORDER BY id
+                LIMIT ?
+                """,
+                [dt_to_epoch_us(now), limit + len(exclude_chats)],
+            ).fetchall()
+        return [
+            OutboxMessage(
+                id=row[0],
+                chat_id=row[1],
+                text=row[2],
+                parse_mode=row[3],
+                photo_urls=orjson.loads(row[4]),
+                captions=orjson.loads(row[5]) or [''] * len(orjson.loads(row[4])),
+                document_name=row[6],
+                document=row[7],
+                text_sent=bool(row[8]),
+                attempts=row[9],
+            )
+            for row in rows
+            if row[1] not in exclude_chats
+        ][:limit]
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                f'SELECT COUNT(*) FROM {OUTBOX_TABLE} WHERE sent_at IS NULL AND failed_at IS NULL'
+            ).fetchone()[0]
+
+    def _update(self, message_id: int, assignments: str, params: list):
+        with self._lock:
+            self._conn.execute(
+                f'UPDATE {OUTBOX_TABLE} SET {assignments} WHERE id = ?', [*params, message_id]
+            )
+
+    def mark_text_sent(self, message_id: int):
+        self._update(message_id, 'text_sent = 1', [])
+
+    def mark_sent(self, message_id: int, now: datetime):
+        self._update(message_id, 'sent_at = ?', [dt_to_epoch_us(now)])
+
+    def postpone(self, message_id: int, until: datetime, error: str, attempt: bool = True):
+        """Schedules the next attempt; a flood wait is not counted as a failed attempt."""
+        self._update(
+            message_id,
+            'next_attempt_at = ?, attempts = attempts + ?, last_error = ?',
+            [dt_to_epoch_us(until), int(attempt), error],
+        )
+
+    def mark_failed(self, message_id: int, now: datetime, error: str):
+        self._update(
+            message_id,
+            'failed_at = ?, attempts = attempts + 1, last_error = ?',
+            [dt_to_epoch_us(now), error],
+        )
+
+    def prune(self, before: datetime) -> int:
+        with self._lock:
+            cur = self._conn.execute(
+                f'DELETE FROM {OUTBOX_TABLE} WHERE COALESCE(sent_at, failed_at) < ?',
+                [dt_to_epoch_us(before)],
+            )
+        return cur.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class OutboxSender:
+    """Delivers the outbox on the event loop of the bot, `max_concurrency` chats at once.
+
+    Only different chats are delivered concurrently; each chat gets its messages one at a
+    time, in the order they were queued, so a summary always precedes its flats and the
+    pages of a digest arrive in order. As every report goes to the one configured channel,
+    reports are in effect delivered serially: order is kept over throughput, which
+    Telegram limits per chat anyway. A flood wait from Telegram pauses every delivery for
+    the requested time, other errors retry the message with exponential backoff until
+    `max_attempts`.
+    """
+
+    def __init__(
+        self,
+        bot: SyncBot,
+        outbox: TelegramOutbox,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    ):
+        self.bot = bot
+        self.outbox = outbox
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        # By chat id, at most one message per chat.
+        self._in_flight: dict[int, asyncio.Task] = {}
+        self._paused_until = 0.0
+        self._semaphore: asyncio.Semaphore | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._drain_task: asyncio.Task | None = None
+
+    async def _flood_pause(self):
+        while (delay := self._paused_until - asyncio.get_running_loop().time()) > 0:
+            await asyncio.sleep(delay)
+
+    async def _send(self, message: OutboxMessage):
+        client = self.bot.client
+        if message.document is not None:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                document_path = pathlib.Path(tmpdir) / message.document_name
+                document_path.write_bytes(message.document)
+                await client.send_file(
+                    entity=message.chat_id,
+                    file=document_path,
+                    caption=message.text or '',
+                    parse_mode=message.parse_mode,
+                    force_document=True,
+                )
+            return
+        if message.text and not message.text_sent:
+            await client.send_message(
+                entity=message.chat_id, message=message.text, parse_mode=message.parse_mode
+            )
+            if message.photo_urls:
+                await asyncio.to_thread(self.outbox.mark_text_sent, message.id)
+        if message.photo_urls:
+            await send_album(
+                client,
+                message.chat_id,
+                message.photo_urls,
+                message.captions,
+                parse_mode=message.parse_mode,
+                photo_cache=self.bot.photo_cache,
+                media_cache=self.bot.media_cache,
+            )
+
+    async def _deliver(self, message: OutboxMessage):
+        async with self._semaphore:
+            await self._flood_pause()
+            try:
+                await self._send(message)
+            except FloodWaitError as e:
+                logger.warning('Telegram asked to wait {} seconds', e.seconds)
+                self._paused_until = max(
+                    self._paused_until, asyncio.get_running_loop().time() + e.seconds
+                )
+                await asyncio.to_thread(
+                    self.outbox.postpone,
+                    message.id,
+                    until=datetime.now() + timedelta(seconds=e.seconds),
+                    error=repr(e),
+                    attempt=False,
+                )
+            except Exception as e:  # noqa: BLE001 -- any failure is retried or given up on.
+                attempts = message.attempts + 1
+                if attempts >= self.max_attempts:
+                    logger.opt(exception=e).error(
+                        'Giving up on outbox message {} after {} attempts', message.id, attempts
+                    )
+                    await asyncio.to_thread(
+                        self.outbox.mark_failed, message.id, now=datetime.now(), error=repr(e)
+                    )
+                    return
+                backoff = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+                backoff += backoff * random.uniform(0, 0.1)
+                logger.warning(
+                    'Delivery of outbox message {} failed ({}), retrying in {}',
+                    message.id,
+                    e,
+                    backoff,
+                )
+                await asyncio.to_thread(
+                    self.outbox.postpone,
+                    message.id,
+                    until=datetime.now() + backoff,
+                    error=repr(e),
+                )
+            else:
+                await asyncio.to_thread(self.outbox.mark_sent, message.id, now=datetime.now())
+
+    def _on_delivered(self, chat_id: int, _: asyncio.Task):
+        self._in_flight.pop(chat_id, None)
+        self._wakeup.set()
+
+    async def _drain(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            # Keeps a few messages queued on the semaphore, so senders never idle.
+            capacity = 2 * self.max_concurrency - len(self._in_flight)
+            due = []
+            if capacity > 0:
+                try:
+                    due = await asyncio.to_thread(
+                        self.outbox.due,
+                        datetime.now(),
+                        capacity,
+                        exclude_chats=set(self._in_flight),
+                    )
+                except sqlite3.Error:
+                    logger.exception('Failed to read the outbox')
+            for message in due:
+                task = asyncio.create_task(self._deliver(message))
+                task.add_done_callback(partial(self._on_delivered, message.chat_id))
+                self._in_flight[message.chat_id] = task
+            with suppress(TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL_SECONDS)
+
+    def start(self):
+        """Starts draining the outbox in the background, for the lifetime of the process."""
+        if self._drain_task is None:
+            self.outbox.prune(datetime.now() - DELIVERED_RETENTION)
+
+            async def create_task() -> asyncio.Task:
+                return asyncio.create_task(self._drain())
+
+            self._drain_task = self.bot.run(create_task())
+
+    def flush(self, timeout: timedelta = DEFAULT_FLUSH_TIMEOUT) -> int:
+        """Waits until the outbox is delivered or `timeout` passes; returns what is left.
+
+        Messages left for later retries stay in the outbox for the next process.
+        """
+        self.start()
+        deadline = time.monotonic() + timeout.total_seconds()
+        while (pending := self.outbox.pending()) and time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL_SECONDS)
+        return pending
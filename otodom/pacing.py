@@ -0,0 +1,134 @@
+import http
+import threading
+import time
+from collections.abc import Mapping
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from loguru import logger
+
+from otodom.rate_limit import HostRateLimiter
+
+BACK_PRESSURE_STATUSES = frozenset({http.HTTPStatus.TOO_MANY_REQUESTS, http.HTTPStatus.FORBIDDEN})
+# Recovery stops once the delay is this close to the floor of the host.
+MIN_DELAY_STEP = 0.05
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Parses `Retry-After`, given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(retry_at.tzinfo)).total_seconds())
+
+
+class AdaptivePacer:
+    """Per-host delay between requests that follows how the server behaves.
+
+    Back-pressure (429/403, `Retry-After`, 5xx, errors) multiplies the delay, latency well
+    above the running average stretches it, and fast clean responses shrink it back to
+    the floor of the host. A floor of zero means the host is not limited until it pushes
+    back. The delay is enforced by the token bucket of the host in `limiter`.
+    """
+
+    def __init__(
+        self,
+        floor_delays: Mapping[str, float] | None = None,
+        default_floor_delay: float = 0.0,
+        max_delay: float = 300.0,
+        initial_backoff: float = 1.0,
+        backoff_factor: float = 2.0,
+        recovery_factor: float = 0.8,
+        slow_latency_factor: float = 2.0,
+        slow_backoff_factor: float = 1.5,
+        latency_smoothing: float = 0.2,
+    ):
+        self.floor_delays = dict(floor_delays or {})
+        self.default_floor_delay = default_floor_delay
+        self.max_delay = max_delay
+        self.initial_backoff = initial_backoff
+        self.backoff_factor = backoff_factor
+        self.recovery_factor = recovery_factor
+        self.slow_latency_factor = slow_latency_factor
+        self.slow_backoff_factor = slow_backoff_factor
+        self.latency_smoothing = latency_smoothing
+        self.limiter = HostRateLimiter()
+        self._delays: dict[str, float] = {}
+        self._mean_latencies: dict[str, float] = {}
+        self._lock = threading.Lock()
+        for host, floor in self.floor_delays.items():
+            self._set_delay(host, floor)
+
+    def floor_delay(self, host: str) -> float:
+        return self.floor_delays.get(host, self.default_floor_delay)
+
+    def current_delay(self, host: str) -> float:
+        with self._lock:
+            return self._delays.get(host, self.floor_delay(host))
+
+    def current_delays(self) -> dict[str, float]:
+        with self._lock:
+            return dict(self._delays)
+
+    def _set_delay(self, host: str, delay: float):
+        self._delays[host] = delay
+        self.limiter.set_rate(host, 1 / delay if delay > 0 else None)
+
+    def wait(self, url: str) -> float:
+        """Blocks until the next request to the host of `url` may go out."""
+        return self.limiter.acquire(url)
+
+    def observe(
+        self,
+        url: str,
+        status: int | None,
+        latency: float,
+        retry_after: float | None = None,
+    ):
+        """Feeds back the outcome of a request; `status` is None when it failed outright."""
+        host = urlsplit(url).netloc
+        with self._lock:
+            floor = self.floor_delay(host)
+            delay = self._delays.get(host, floor)
+            mean_latency = self._mean_latencies.get(host, latency)
+            self._mean_latencies[host] = (
+                1 - self.latency_smoothing
+            ) * mean_latency + self.latency_smoothing * latency
+
+            back_pressure = (
+                status is None
+                or status in BACK_PRESSURE_STATUSES
+                or status >= http.HTTPStatus.INTERNAL_SERVER_ERROR
+                or retry_after is not None
+            )
+            if back_pressure:
+                new_delay = max(delay * self.backoff_factor, self.initial_backoff)
+            elif delay > 0 and latency > self.slow_latency_factor * mean_latency:
+                # Only paced hosts react to latency: response times of unpaced hosts vary
+                # with payload size (photos) more than with server load.
+                new_delay = delay * self.slow_backoff_factor
+            else:
+                new_delay = floor + (delay - floor) * self.recovery_factor
+                if new_delay - floor < MIN_DELAY_STEP:
+                    new_delay = floor
+            new_delay = min(new_delay, max(self.max_delay, floor))
+            if new_delay != delay:
+                self._set_delay(host, new_delay)
+
+        if retry_after is not None:
+            self.limiter.bucket_for(host).block_until(time.monotonic() + retry_after)
+        if new_delay > delay:
+            logger.warning(
+                'Slowing down requests to {}: delay {:.1f}s -> {:.1f}s (status {}, latency {:.2f}s)',
+                host,
+                delay,
+                new_delay,
+                status,
+                latency,
+            )
@@ -0,0 +1,201 @@
+"""Content-addressed on-disk cache of the photos sent to Telegram.
+
+Photos are streamed in chunks to `data/photos/objects/<sha256 of the content>.jpg`, never
+held in memory whole, and `data/photos/urls/<sha256 of the URL>` names the object of every
+downloaded URL. A flat reported again as UPDATED is therefore uploaded straight from disk,
+and the same image behind different URLs is stored once. Once the objects outgrow
+`max_bytes`, the least recently used ones are evicted; every hit refreshes the
+modification time that tracks the use.
+
+With an `otodom.image_processing.ImageProcessor`, photos are downscaled before they are
+stored, as `<sha256 of the downloaded content>-<settings>.jpg`, so changing the settings
+never serves photos processed with the old ones.
+"""
+
+import hashlib
+import os
+import pathlib
+import tempfile
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, suppress
+
+from loguru import logger
+
+from otodom.http_client import get_http_client
+from otodom.image_processing import ImageProcessor
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_CONCURRENT_DOWNLOADS = 4
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT_SECONDS = 15
+# Temporary files this old are left over from interrupted downloads, not being written.
+STALE_TMP_AGE_SECONDS = 60 * 60
+
+
+def get_photo_cache_path(base_data_path: pathlib.Path) -> pathlib.Path:
+    return base_data_path / 'data' / 'photos'
+
+
+def _url_key(url: str) -> str:
+    return hashlib.sha256(url.encode('utf8')).hexdigest()
+
+
+class PhotoCache:
+    """Downloads photos concurrently into the cache, safe to use from any thread.
+
+    Photos handed out by `photos()` are pinned: they are not evicted before the block
+    exits, even if other uploads meanwhile push the cache over its size.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_concurrent_downloads: int = DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+        image_processor: ImageProcessor | None = None,
+    ):
+        self.objects_path = path / 'objects'
+        self.urls_path = path / 'urls'
+        self.objects_path.mkdir(parents=True, exist_ok=True)
+        self.urls_path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_concurrent_downloads = max_concurrent_downloads
+        self.image_processor = image_processor
+        self._lock = threading.Lock()
+        self._pinned: Counter[pathlib.Path] = Counter()
+        self._remove_stale_tmp_files()
+        self._total_bytes = sum(p.stat().st_size for p in self.objects_path.glob('*.jpg'))
+
+    def _remove_stale_tmp_files(self):
+        cutoff = time.time() - STALE_TMP_AGE_SECONDS
+        removed = 0
+        for tmp_path in [*self.objects_path.glob('*.tmp'), *self.urls_path.glob('*.tmp')]:
+            with suppress(FileNotFoundError):
+                if tmp_path.stat().st_mtime < cutoff:
+                    tmp_path.unlink()
+                    removed += 1
+        if removed:
+            logger.info('Removed {} files left over from interrupted downloads', removed)
+
+    def _object_path(self, content_hash: str) -> pathlib.Path:
+        if self.image_processor is None:
+            return self.objects_path / f'{content_hash}.jpg'
+        return self.objects_path / f'{content_hash}-{self.image_processor.variant}.jpg'
+
+    def _lookup(self, url: str) -> pathlib.Path | None:
+        url_path = self.urls_path / _url_key(url)
+        with self._lock:
+            if not url_path.exists():
+                return None
+            object_path = self._object_path(url_path.read_text())
+            if not object_path.exists():
+                # Evicted or processed differently: the URL is downloaded again.
+                url_path.unlink(missing_ok=True)
+                return None
+            object_path.touch()
+            self._pinned[object_path] += 1
+        return object_path
+
+    def _download(self, url: str, skip_missing: bool) -> pathlib.Path | None:
+        digest = hashlib.sha256()
+        with get_http_client().get(url, stream=True, timeout=DOWNLOAD_TIMEOUT_SECONDS) as r:
+            if skip_missing and 400 <= r.status_code < 500:
+                logger.warning('Skipping photo {}, got HTTP {}', url, r.status_code)
+                return None
+            r.raise_for_status()
+            with tempfile.NamedTemporaryFile(
+                dir=self.objects_path, suffix='.tmp', delete=False
+            ) as f:
+                tmp_path = pathlib.Path(f.name)
+                try:
+                    for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        digest.update(chunk)
+                        f.write(chunk)
+                except BaseException:
+                    tmp_path.unlink(missing_ok=True)
+                    raise
+        if self.image_processor is not None:
+            tmp_path = self.image_processor.shrink(tmp_path, tmp_path.with_suffix('.processed.tmp'))
+        object_path = self._object_path(digest.hexdigest())
+        url_path = self.urls_path / _url_key(url)
+        with self._lock:
+            if object_path.exists():
+                tmp_path.unlink()
+                object_path.touch()
+            else:
+                self._total_bytes += tmp_path.stat().st_size
+                os.replace(tmp_path, object_path)
+            url_tmp_path = url_path.with_suffix('.tmp')
+            url_tmp_path.write_text(digest.hexdigest())
+            os.replace(url_tmp_path, url_path)
+            self._pinned[object_path] += 1
+        logger.info('Downloaded {} to {}', url, object_path)
+        return object_path
+
+    def _evict(self):
+        with self._lock:
+            if self._total_bytes <= self.max_bytes:
+                return
+            objects = sorted(
+                ((p, p.stat()) for p in self.objects_path.glob('*.jpg')),
+                key=lambda item: item[1].st_mtime,
+            )
+            evicted = 0
+            for object_path, stat in objects:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                if self._pinned[object_path]:
+                    continue
+                object_path.unlink(missing_ok=True)
+                self._total_bytes -= stat.st_size
+                evicted += 1
+        # Entries of the evicted URLs are dropped by `_lookup` when they are looked up again.
+        logger.info('Evicted {} photos from the cache', evicted)
+
+    def _unpin(self, paths: Sequence[pathlib.Path | None]):
+        with self._lock:
+            for path in paths:
+                if path is not None:
+                    self._pinned[path] -= 1
+                    if not self._pinned[path]:
+                        del self._pinned[path]
+
+    @contextmanager
+    def photos(
+        self, photo_urls: Sequence[str], skip_missing: bool = False
+    ) -> Iterator[list[pathlib.Path | None]]:
+        """Yields the local files of the photos, in order, downloading the missing ones.
+
+        With `skip_missing`, photos the server no longer has (a 4xx response) are `None`
+        instead of failing the whole batch.
+        """
+        local_paths: dict[str, pathlib.Path | None] = {}
+        try:
+            for url in dict.fromkeys(photo_urls):
+                local_paths[url] = self._lookup(url)
+            if missing := [url for url, path in local_paths.items() if path is None]:
+                with ThreadPoolExecutor(
+                    max_workers=min(len(missing), self.max_concurrent_downloads),
+                    thread_name_prefix='photo-download',
+                ) as pool:
+                    downloads = {
+                        url: pool.submit(self._download, url, skip_missing=skip_missing)
+                        for url in missing
+                    }
+                # Keeps the photos that did download, so the `finally` below unpins them.
+                failures = []
+                for url, download in downloads.items():
+                    try:
+                        local_paths[url] = download.result()
+                    except Exception as e:  # noqa: BLE001 -- the first one is re-raised below.
+                        failures.append(e)
+                if failures:
+                    raise failures[0]
+                self._evict()
+            yield [local_paths[url] for url in photo_urls]
+        finally:
+            self._unpin(list(local_paths.values()))
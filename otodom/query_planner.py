@@ -0,0 +1,68 @@
+from collections.abc import Sequence
+from typing import NamedTuple
+
+from cytoolz import groupby
+
+from otodom.flat_filter import EstateFilter
+
+
+class QueryGroup(NamedTuple):
+    # The filter that is actually sent to otodom.
+    query: EstateFilter
+    # The filters whose results are evaluated locally from the query results.
+    members: list[EstateFilter]
+
+
+def _compatibility_key(f: EstateFilter) -> tuple:
+    # Everything that is enforced only by the server has to be identical within a group.
+    return f.rent_type, frozenset(f.extras), frozenset(f.media), f.min_built_year
+
+
+def _merge_locations(filters: Sequence[EstateFilter]) -> list[str]:
+    locations = list(dict.fromkeys(loc for f in filters for loc in f.locations))
+    # A district already covers its sub-districts, e.g. `.../mokotow` covers `.../mokotow/sluzewiec`.
+    return [
+        loc
+        for loc in locations
+        if not any(loc != other and loc.startswith(f'{other}/') for other in locations)
+    ]
+
+
+def _loosest_min(values: list[int | None]) -> int | None:
+    return None if any(v is None for v in values) else min(values)
+
+
+def _loosest_max(values: list[int | None]) -> int | None:
+    return None if any(v is None for v in values) else max(values)
+
+
+def merge_filters(filters: Sequence[EstateFilter]) -> EstateFilter:
+    """Builds the narrowest single query whose results contain the results of every filter."""
+    first = filters[0]
+    if any(_compatibility_key(f) != _compatibility_key(first) for f in filters):
+        raise ValueError(f'Filters {[f.name for f in filters]} cannot be merged')
+    query = EstateFilter('+'.join(f.name for f in filters))
+    query.rent_type = first.rent_type
+    query.extras = set(first.extras)
+    query.media = set(first.media)
+    query.min_built_year = first.min_built_year
+    query.locations = _merge_locations(filters)
+    query.price_min = _loosest_min([f.price_min for f in filters])
+    query.price_max = _loosest_max([f.price_max for f in filters])
+    query.area_min = _loosest_min([f.area_min for f in filters])
+    query.area_max = _loosest_max([f.area_max for f in filters])
+    query.description = [f'Merged query for {", ".join(f.name for f in filters)}']
+    return query
+
+
+def plan_queries(filters: Sequence[EstateFilter]) -> list[QueryGroup]:
+    """Groups filters that differ only in locally checkable constraints into one query each.
+
+    Every member filter then gets its own results through `EstateFilter.matches_filter`,
+    so overlapping filters cost the requests of one broader query.
+    """
+    groups = []
+    for members in groupby(_compatibility_key, filters).values():
+        query = members[0] if len(members) == 1 else merge_filters(members)
+        groups.append(QueryGroup(query=query, members=list(members)))
+    return groups
@@ -0,0 +1,83 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, at most `capacity` stored."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        if rate <= 0:
+            raise ValueError(f'Rate must be positive, got {rate}')
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def set_rate(self, rate: float):
+        if rate <= 0:
+            raise ValueError(f'Rate must be positive, got {rate}')
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+
+    def block_until(self, deadline: float):
+        """Makes every caller wait at least until the `time.monotonic()` deadline."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, deadline)
+
+    def acquire(self) -> float:
+        """Blocks until a token is available and returns the time spent waiting."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Tokens may go negative: every caller reserves its own slot in the future,
+            # so concurrent callers are spaced by 1 / rate instead of racing for one token.
+            self._tokens -= 1
+            wait_for = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            if self._blocked_until > now + wait_for:
+                wait_for = self._blocked_until - now
+                # Callers behind this one are spaced from the end of the block.
+                self._blocked_until += 1 / self.rate
+        if wait_for:
+            time.sleep(wait_for)
+        return wait_for
+
+
+class HostRateLimiter:
+    """Keeps one token bucket per host, so fetchers for the same site share one budget."""
+
+    def __init__(self, default_rate: float | None = None, capacity: float = 1.0):
+        self.default_rate = default_rate
+        self.capacity = capacity
+        self._rates: dict[str, float | None] = {}
+        self._buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def set_rate(self, host: str, rate: float | None):
+        """Changes the rate of the host in place; `None` lifts the limit."""
+        with self._lock:
+            self._rates[host] = rate
+            if rate is None:
+                self._buckets.pop(host, None)
+            elif host in self._buckets:
+                self._buckets[host].set_rate(rate)
+
+    def bucket_for(self, host: str) -> TokenBucket | None:
+        with self._lock:
+            if host not in self._buckets:
+                rate = self._rates.get(host, self.default_rate)
+                if rate is None:
+                    return None
+                self._buckets[host] = TokenBucket(rate=rate, capacity=self.capacity)
+            return self._buckets[host]
+
+    def acquire(self, url: str) -> float:
+        bucket = self.bucket_for(urlsplit(url).netloc)
+        return bucket.acquire() if bucket else 0.0
@@ -1,15 +1,20 @@
 import json
 import pathlib
+import sqlite3
 import tempfile
 import textwrap
 import traceback
 from collections.abc import Mapping
 from datetime import datetime
 from types import MappingProxyType
+from typing import Literal
 
 from loguru import logger
 
+from otodom.digest import render_digest_document, render_digest_pages
 from otodom.models import Flat
+from otodom.notifications import Notification, render_notifications, send_notifications
+from otodom.outbox import enqueue
 from otodom.telegram_sync import SyncBot, escape_markdown
 
 CANONICAL_CHANNEL_IDS: Mapping[str, int] = MappingProxyType(
@@ -25,6 +30,13 @@ CANONICAL_CHANNEL_IDS: Mapping[str, int] = MappingProxyType(
 )
 
 
+def _flat_notification(flat: Flat, prefix: str = '') -> Notification:
+    return Notification(
+        caption=_compose_html_report(flat, prefix=prefix),
+        photo_urls=[flat.picture_url] if flat.picture_url else [],
+    )
+
+
 def _compose_html_report(flat: Flat, prefix: str):
     report = textwrap.dedent(
         f"""\
@@ -47,15 +59,10 @@ def _compose_html_report(flat: Flat, prefix: str):
 #     stop=tenacity.stop_after_attempt(10),
 # )
 def _send_flat_summary(bot: SyncBot, flat: Flat, telegram_channel_id: int, prefix: str = ''):
-    bot.send_message(
-        telegram_channel_id,
-        _compose_html_report(flat, prefix=prefix),
-        parse_mode='html',
+    send_notifications(
+        bot, telegram_channel_id, [_flat_notification(flat, prefix=prefix)], parse_mode='html'
     )
 
-    if flat.picture_url:
-        bot.send_photo_from_url(telegram_channel_id, flat.picture_url)
-
 
 def report_message(bot: SyncBot, telegram_channel_id: int, message: str, escape: bool = False):
     if escape:
@@ -99,35 +106,58 @@ Please check the server\\.
 
 
 def report_new_flats(
+    conn: sqlite3.Connection,
     new_flats: list[Flat],
     updated_flats: list[Flat],
     filter_name: str,
     total_flats: int,
-    bot: SyncBot,
     now: datetime,
     report_on_no_new_flats: bool,
     telegram_channel_id: int,
+    digest_threshold: int | None = None,
+    digest_attachment: Literal['csv', 'html'] | None = None,
 ):
+    """Queues the report in the outbox, which `otodom.outbox.OutboxSender` delivers.
+
+    A writer job, run in the transaction that stores the reported flats. The flats are
+    rendered into albums captioned per flat, see `otodom.notifications`. More than
+    `digest_threshold` flats are listed in a paginated digest instead, with the optional
+    `digest_attachment`, see `otodom.digest`.
+    """
     summary_report = f'Found {len(new_flats)} new flats, {len(updated_flats)} updated flats for filter #{filter_name} at {now.isoformat()}, total flats: {total_flats}'
     logger.info(summary_report)
 
+    if digest_threshold is not None and len(new_flats) + len(updated_flats) > digest_threshold:
+        # Every page starts with the summary, so it is not sent on its own.
+        for page in render_digest_pages(summary_report, new_flats, updated_flats):
+            enqueue(conn, telegram_channel_id, page, parse_mode='html')
+        if digest_attachment:
+            enqueue(
+                conn,
+                telegram_channel_id,
+                f'All {len(new_flats) + len(updated_flats)} flats of #{filter_name}',
+                parse_mode='html',
+                document=render_digest_document(
+                    filter_name, new_flats, updated_flats, now=now, attachment=digest_attachment
+                ),
+            )
+        return
+
     if (new_flats or updated_flats) or report_on_no_new_flats:
-        bot.send_message(
+        enqueue(conn, telegram_channel_id, summary_report, parse_mode='html')
+    notifications = [
+        _flat_notification(flat, prefix=f'Filter: <code>{filter_name}</code>\n<b>NEW</b>')
+        for flat in new_flats
+    ] + [
+        _flat_notification(flat, prefix=f'Filter: #{filter_name}\n<b>UPDATED</b>')
+        for flat in updated_flats
+    ]
+    for call in render_notifications(notifications):
+        enqueue(
+            conn,
             telegram_channel_id,
-            summary_report,
+            call.text,
             parse_mode='html',
-        )
-    for flat in new_flats:
-        _send_flat_summary(
-            bot,
-            flat,
-            telegram_channel_id,
-            prefix=f'Filter: <code>{filter_name}</code>\n<b>NEW</b>',
-        )
-    for flat in updated_flats:
-        _send_flat_summary(
-            bot,
-            flat,
-            telegram_channel_id,
-            prefix=f'Filter: #{filter_name}\n<b>UPDATED</b>',
+            photo_urls=call.photo_urls,
+            captions=call.captions,
         )
@@ -0,0 +1,166 @@
+"""Retention of the flats DB: archives listings gone from the site and compacts the file.
+
+Listings not seen on any fetched page for the retention period are written, together
+with their filter memberships and history, to `data/archive/<YYYY-MM-DD>.jsonl.gz` and
+deleted from the DB. Should such a listing come back, it is reported as new again.
+"""
+
+import gzip
+import pathlib
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timedelta
+
+import orjson
+from loguru import logger
+
+from otodom.storage import (
+    FILTER_MEMBERSHIP_TABLE,
+    FLAT_HISTORY_TABLE,
+    LISTINGS_TABLE,
+    SQLITE_PRAGMAS,
+    StorageContext,
+    init_storage,
+    transaction,
+)
+from otodom.util import dt_to_epoch_us, epoch_us_to_dt
+
+ARCHIVE_BATCH_SIZE = 1_000
+# VACUUM rewrites the whole file, so it only runs once enough pages are free.
+VACUUM_MIN_FREE_RATIO = 0.1
+
+_LISTING_COLUMNS = [
+    'url',
+    'found_ts',
+    'title',
+    'picture_url',
+    'summary_location',
+    'price',
+    'updated_at',
+    'last_seen_at',
+]
+_TIMESTAMP_COLUMNS = {'found_ts', 'updated_at', 'last_seen_at', 'seen_at'}
+
+
+def _row_to_dict(columns: list[str], row: tuple) -> dict:
+    return {
+        column: epoch_us_to_dt(value)
+        if column in _TIMESTAMP_COLUMNS and value is not None
+        else value
+        for column, value in zip(columns, row, strict=True)
+    }
+
+
+def _load_archived_listings(conn: sqlite3.Connection, urls: list[str]) -> list[dict]:
+    placeholders = ','.join('?' * len(urls))
+    with closing(conn.cursor()) as cur:
+        listings = {
+            row[0]: _row_to_dict(_LISTING_COLUMNS, row) | {'filters': [], 'history': []}
+            for row in cur.execute(
+                f'SELECT {", ".join(_LISTING_COLUMNS)} FROM {LISTINGS_TABLE} '
+                f'WHERE url IN ({placeholders})',
+                urls,
+            )
+        }
+        for row in cur.execute(
+            f'SELECT url, filter_name, found_ts, updated_at FROM {FILTER_MEMBERSHIP_TABLE} '
+            f'WHERE url IN ({placeholders})',
+            urls,
+        ):
+            listings[row[0]]['filters'].append(
+                _row_to_dict(['filter_name', 'found_ts', 'updated_at'], row[1:])
+            )
+        for row in cur.execute(
+            f'SELECT url, price, updated_at, seen_at FROM {FLAT_HISTORY_TABLE} '
+            f'WHERE url IN ({placeholders}) ORDER BY url, seen_at',
+            urls,
+        ):
+            listings[row[0]]['history'].append(
+                _row_to_dict(['price', 'updated_at', 'seen_at'], row[1:])
+            )
+    return list(listings.values())
+
+
+def _delete_listings(conn: sqlite3.Connection, urls: list[str]):
+    with closing(conn.cursor()) as cur:
+        for table in (FILTER_MEMBERSHIP_TABLE, FLAT_HISTORY_TABLE, LISTINGS_TABLE):
+            cur.executemany(f'DELETE FROM {table} WHERE url = ?', ((url,) for url in urls))
+
+
+def _archive_batch(
+    conn: sqlite3.Connection, archive_file: pathlib.Path, cutoff_us: int, batch_size: int
+) -> int:
+    with transaction(conn):
+        urls = [
+            row[0]
+            for row in conn.execute(
+                f'SELECT url FROM {LISTINGS_TABLE} WHERE last_seen_at < ? LIMIT ?',
+                [cutoff_us, batch_size],
+            )
+        ]
+        if urls:
+            listings = _load_archived_listings(conn, urls)
+            with archive_file.open('ab') as f:
+                f.write(
+                    gzip.compress(b''.join(orjson.dumps(listing) + b'\n' for listing in listings))
+                )
+            _delete_listings(conn, urls)
+    return len(urls)
+
+
+def archive_stale_listings(
+    storage_context: StorageContext,
+    now: datetime,
+    retention: timedelta,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+) -> int:
+    """Moves listings not seen since `now - retention` to the archive, in batches.
+
+    Every batch is a writer job of its own, so fetches are not held up for long. It is
+    appended to the archive as a gzip member before it is deleted in one transaction; a
+    batch interrupted in between is archived again by the next run. Returns the number
+    of archived listings.
+    """
+    archive_file = storage_context.listing_archive_path / f'{now.date().isoformat()}.jsonl.gz'
+    cutoff_us = dt_to_epoch_us(now - retention)
+    archived = 0
+    while batch := storage_context.writer.call(
+        _archive_batch, archive_file, cutoff_us=cutoff_us, batch_size=batch_size
+    ):
+        archived += batch
+    logger.info(
+        'Archived {} listings not seen since {} to {}', archived, now - retention, archive_file
+    )
+    return archived
+
+
+def compact_db(conn: sqlite3.Connection, min_free_ratio: float = VACUUM_MIN_FREE_RATIO) -> int:
+    """Refreshes the planner statistics and vacuums a fragmented DB. A writer job.
+
+    Returns the number of bytes reclaimed.
+    """
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    conn.execute('ANALYZE')
+    if page_count and free_pages / page_count >= min_free_ratio:
+        logger.info('Vacuuming the DB, {} of {} pages are free', free_pages, page_count)
+        # The temporary copy of VACUUM goes to disk: it is as large as the DB itself.
+        conn.execute('PRAGMA temp_store = FILE')
+        try:
+            conn.execute('VACUUM')
+        finally:
+            conn.execute(f'PRAGMA temp_store = {SQLITE_PRAGMAS["temp_store"]}')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    reclaimed = (page_count - conn.execute('PRAGMA page_count').fetchone()[0]) * page_size
+    logger.info('Compacted the DB, reclaimed {} bytes', reclaimed)
+    return reclaimed
+
+
+def run_retention(data_path: str, retention_days: int):
+    storage_context = init_storage(pathlib.Path(data_path).absolute())
+    with closing(storage_context.writer):
+        archive_stale_listings(
+            storage_context, now=datetime.now(), retention=timedelta(days=retention_days)
+        )
+        storage_context.writer.call(compact_db)
@@ -1,140 +1,371 @@
 import pathlib
 import sqlite3
-import textwrap
-from contextlib import closing
+from collections.abc import Iterator
+from contextlib import closing, contextmanager
 from datetime import datetime
 from typing import NamedTuple
 
+from otodom.migrations import migrate
 from otodom.models import Flat
-from otodom.util import dt_to_naive_utc
+from otodom.storage_writer import StorageWriter
+from otodom.util import dt_to_epoch_us, epoch_us_to_dt
 
+# A view over the two tables below, with the columns of the table it replaced.
 FLATS_TABLE = 'flats'
+LISTINGS_TABLE = 'listings'
+FILTER_MEMBERSHIP_TABLE = 'filter_membership'
+CRAWL_STATE_TABLE = 'crawl_state'
+# Per-connection scratch tables for the flats being diffed and every listing seen.
+FETCHED_FLATS_TABLE = 'fetched_flats'
+SEEN_URLS_TABLE = 'seen_urls'
+FLAT_HISTORY_TABLE = 'flat_history'
+FILTER_COUNTERS_TABLE = 'filter_counters'
+# WAL lets readers (ad-hoc analysis) run while the fetcher writes, and with WAL
+# `synchronous=NORMAL` only syncs on checkpoints while staying consistent after a crash.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16_000,  # KiB
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5_000,  # ms
+}
+SQLITE_CACHED_STATEMENTS = 256
+_SAVEPOINT = 'nested_write'
 
 
 class StorageContext(NamedTuple):
-    sqlite_conn: sqlite3.Connection
+    # Owns the connection: every DB access is a job submitted to it.
+    writer: StorageWriter
     sqlite_path: pathlib.Path
     raw_json_path: pathlib.Path
+    http_cache_path: pathlib.Path
+    # Listings removed from the DB by retention, see `otodom.retention`.
+    listing_archive_path: pathlib.Path
 
 
 class NewAndUpdateFlats(NamedTuple):
     new_flats: list[Flat]
     updated_flats: list[Flat]
+    # Stored flats of the filter whose price changed without a new `updated_at`.
+    repriced_flats: list[Flat]
+    # Stored flats of the filter that were not fetched, see `filter_new_estates`.
+    disappeared_urls: list[str]
+
+
+def get_db_file(base_data_path: pathlib.Path) -> pathlib.Path:
+    return base_data_path / 'data' / 'sqlite' / 'flats.db'
 
 
 def init_storage(base_data_path: pathlib.Path) -> StorageContext:
     data_path = base_data_path / 'data'
-    sqlite_db_path = data_path / 'sqlite'
+    sqlite_db_path = get_db_file(base_data_path).parent
     raw_json_path = data_path / 'json'
+    http_cache_path = data_path / 'http_cache'
+    listing_archive_path = data_path / 'archive'
 
     sqlite_db_path.mkdir(parents=True, exist_ok=True)
     raw_json_path.mkdir(parents=True, exist_ok=True)
+    http_cache_path.mkdir(parents=True, exist_ok=True)
+    listing_archive_path.mkdir(parents=True, exist_ok=True)
 
-    conn = sqlite3.connect((sqlite_db_path / 'flats.db').absolute())
-    cur = conn.cursor()
-    with closing(cur):
-        res = cur.execute(
-            f"""SELECT name FROM sqlite_master WHERE type='table' AND name='{FLATS_TABLE}';"""
+    def connect() -> sqlite3.Connection:
+        # Autocommit mode: transactions are only opened explicitly by `transaction`.
+        conn = sqlite3.connect(
+            get_db_file(base_data_path).absolute(),
+            isolation_level=None,
+            cached_statements=SQLITE_CACHED_STATEMENTS,
         )
-        exists = bool(res.fetchone())
-        if not exists:
-            cur.execute(
-                f"""
-            CREATE TABLE {FLATS_TABLE} (
-                url text not null,
-                found_ts text,
-                title text,
-                picture_url text,
-                summary_location text,
-                price INTEGER,
-                updated_at text,
-                filter_name text not null,
-                PRIMARY KEY (url, filter_name)
-            )
-            """
-            )
-        conn.commit()
-    return StorageContext(sqlite_conn=conn, raw_json_path=raw_json_path, sqlite_path=sqlite_db_path)
+        for pragma, value in SQLITE_PRAGMAS.items():
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        migrate(conn)
+        return conn
+
+    return StorageContext(
+        writer=StorageWriter(connect),
+        raw_json_path=raw_json_path,
+        sqlite_path=sqlite_db_path,
+        http_cache_path=http_cache_path,
+        listing_archive_path=listing_archive_path,
+    )
+
+
+def _begin(conn: sqlite3.Connection) -> bool:
+    nested = conn.in_transaction
+    conn.execute(f'SAVEPOINT {_SAVEPOINT}' if nested else 'BEGIN')
+    return nested
+
+
+def _rollback(conn: sqlite3.Connection, nested: bool):
+    if nested:
+        conn.execute(f'ROLLBACK TO {_SAVEPOINT}')
+        conn.execute(f'RELEASE {_SAVEPOINT}')
+    else:
+        conn.execute('ROLLBACK')
+
+
+def _commit(conn: sqlite3.Connection, nested: bool):
+    conn.execute(f'RELEASE {_SAVEPOINT}' if nested else 'COMMIT')
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[None]:
+    """Groups every write made inside into one transaction, so a fetch cycle costs one sync.
+
+    Nested uses become savepoints, so a failing inner block only rolls back its own
+    writes. Meant for writer jobs; other threads use `write_transaction`.
+    """
+    nested = _begin(conn)
+    try:
+        yield
+    except BaseException:
+        _rollback(conn, nested)
+        raise
+    _commit(conn, nested)
+
+
+@contextmanager
+def write_transaction(storage_context: StorageContext) -> Iterator[None]:
+    """Like `transaction`, for a block that submits its writes as jobs to the writer.
+
+    Jobs submitted meanwhile by other threads run inside the transaction as well. A
+    nested block that must roll back on its own belongs in a single job instead.
+    """
+    writer = storage_context.writer
+    nested = writer.call(_begin)
+    try:
+        yield
+    except BaseException:
+        writer.call(_rollback, nested)
+        raise
+    writer.call(_commit, nested)
+
+
+def _load_fetched_flats(cur: sqlite3.Cursor, flats: list[Flat]):
+    cur.execute(
+        f"""
+        CREATE TEMP TABLE IF NOT EXISTS {FETCHED_FLATS_TABLE} (
+            url text not null PRIMARY KEY,
+            updated_at INTEGER,
+            price INTEGER
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(f'DELETE FROM {FETCHED_FLATS_TABLE}')
+    cur.executemany(
+        f'INSERT OR REPLACE INTO {FETCHED_FLATS_TABLE} VALUES (?, ?, ?)',
+        ((f.url, dt_to_epoch_us(f.updated_ts), f.price) for f in flats),
+    )
+
+
+def _load_seen_urls(cur: sqlite3.Cursor, urls: list[str]):
+    cur.execute(
+        f"""
+        CREATE TEMP TABLE IF NOT EXISTS {SEEN_URLS_TABLE} (
+            url text not null PRIMARY KEY
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(f'DELETE FROM {SEEN_URLS_TABLE}')
+    cur.executemany(f'INSERT OR IGNORE INTO {SEEN_URLS_TABLE} VALUES (?)', ((url,) for url in urls))
 
 
 def filter_new_estates(
-    conn: sqlite3.Connection, flats: list[Flat], filter_name: str
+    conn: sqlite3.Connection,
+    flats: list[Flat],
+    filter_name: str,
+    seen_urls: list[str] | None = None,
 ) -> NewAndUpdateFlats:
+    """Diffs the fetched flats against the stored ones of the filter.
+
+    The fetched `(url, updated_at, price)` rows are bulk-loaded into a temp table and
+    joined on the primary key, so the cost grows linearly with the number of flats.
+    Timestamps are compared as epoch integers inside SQLite, so no datetime is built for
+    stored rows. Prices are compared with the stored listing, shared by all filters.
+    With `seen_urls`, the stored flats of the filter missing from them are disappeared.
+    `flats` only holds the changed pages, so `seen_urls` must list every listing of the
+    result pages, unchanged ones included, and is only meaningful after a complete crawl.
+    """
     cur = conn.cursor()
-    urls = [f"""'{f.url}'""" for f in flats]
-    urls_in_cond = ','.join(urls)
     with closing(cur):
+        _load_fetched_flats(cur, flats)
         res = cur.execute(
             f"""
-            SELECT url, updated_at
-            FROM {FLATS_TABLE}
-            WHERE url IN ({urls_in_cond}) AND filter_name = ?
-        """,
+            SELECT
+                fetched.url,
+                CASE
+                    WHEN stored.url IS NULL THEN 'new'
+                    WHEN fetched.updated_at > stored.updated_at THEN 'updated'
+                    ELSE 'repriced'
+                END
+            FROM {FETCHED_FLATS_TABLE} AS fetched
+            LEFT JOIN {FILTER_MEMBERSHIP_TABLE} AS stored
+                ON stored.url = fetched.url AND stored.filter_name = ?
+            LEFT JOIN {LISTINGS_TABLE} AS listing ON listing.url = fetched.url
+            WHERE stored.url IS NULL
+                OR fetched.updated_at > stored.updated_at
+                OR fetched.price IS NOT listing.price
+            """,
             [filter_name],
         )
-        conn.commit()
-        url_to_item = {t[0]: t for t in res}
-
-    new_flats = [f for f in flats if f.url not in url_to_item]
-    updated_flats = [
-        f
-        for f in flats
-        if f.url in url_to_item and f.updated_ts > datetime.fromisoformat(url_to_item[f.url][1])
-    ]
+        changes = dict(res.fetchall())
+        disappeared_urls = []
+        if seen_urls is not None:
+            _load_seen_urls(cur, seen_urls)
+            res = cur.execute(
+                f"""
+                SELECT stored.url
+                FROM {FILTER_MEMBERSHIP_TABLE} AS stored
+                WHERE stored.filter_name = ? AND NOT EXISTS (
+                    SELECT 1 FROM {SEEN_URLS_TABLE} AS seen WHERE seen.url = stored.url
+                )
+                """,
+                [filter_name],
+            )
+            disappeared_urls = [row[0] for row in res]
+            cur.execute(f'DELETE FROM {SEEN_URLS_TABLE}')
+        cur.execute(f'DELETE FROM {FETCHED_FLATS_TABLE}')
 
-    return NewAndUpdateFlats(new_flats=new_flats, updated_flats=updated_flats)
+    flats_by_url = {f.url: f for f in flats}
+    return NewAndUpdateFlats(
+        new_flats=[flats_by_url[url] for url, change in changes.items() if change == 'new'],
+        updated_flats=[flats_by_url[url] for url, change in changes.items() if change == 'updated'],
+        repriced_flats=[
+            flats_by_url[url] for url, change in changes.items() if change == 'repriced'
+        ],
+        disappeared_urls=disappeared_urls,
+    )
 
 
-def get_total_flats_in_db(conn: sqlite3.Connection, filter_name: str):
+def get_total_flats_in_db(conn: sqlite3.Connection, filter_name: str) -> int:
+    # Maintained by triggers on the flats table, see `otodom.migrations`.
     cur = conn.cursor()
     with closing(cur):
         res = cur.execute(
             f"""
-            SELECT COUNT(*) FROM {FLATS_TABLE}
+            SELECT total_flats FROM {FILTER_COUNTERS_TABLE}
             WHERE filter_name = ?
         """,
             [filter_name],
         )
-        return res.fetchone()[0]
+        row = res.fetchone()
+        return row[0] if row else 0
 
 
-def _insert_flats_unsafe(cur: sqlite3.Cursor, flats: list[Flat], filter_name: str):
-    cur.executemany(
-        f"""
-        INSERT INTO {FLATS_TABLE} VALUES(?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            (
-                f.url,
-                f.found_ts.isoformat(),
-                f.title,
-                f.picture_url,
-                f.summary_location,
-                f.price,
-                dt_to_naive_utc(f.updated_ts).isoformat(),
-                filter_name,
+def upsert_flats(conn: sqlite3.Connection, flats: list[Flat], filter_name: str):
+    """Stores new and changed flats of the filter in place, keeping their first `found_ts`.
+
+    A listing shared by several filters is stored once; filters that see it again with
+    the same `updated_at` and price only touch their membership row.
+    """
+    cur = conn.cursor()
+    with closing(cur):
+        cur.executemany(
+            f"""
+            INSERT INTO {LISTINGS_TABLE} (
+                url, found_ts, title, picture_url, summary_location, price, updated_at,
+                last_seen_at
             )
-            for f in flats
-        ),
-    )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET
+                title = excluded.title,
+                picture_url = excluded.picture_url,
+                summary_location = excluded.summary_location,
+                price = excluded.price,
+                updated_at = excluded.updated_at
+            WHERE excluded.updated_at IS NOT {LISTINGS_TABLE}.updated_at
+                OR excluded.price IS NOT {LISTINGS_TABLE}.price
+            """,
+            (
+                (
+                    f.url,
+                    dt_to_epoch_us(f.found_ts),
+                    f.title,
+                    f.picture_url,
+                    f.summary_location,
+                    f.price,
+                    dt_to_epoch_us(f.updated_ts),
+                    dt_to_epoch_us(f.found_ts),
+                )
+                for f in flats
+            ),
+        )
+        cur.executemany(
+            f"""
+            INSERT INTO {FILTER_MEMBERSHIP_TABLE} (url, filter_name, found_ts, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (url, filter_name) DO UPDATE SET updated_at = excluded.updated_at
+            """,
+            (
+                (
+                    f.url,
+                    filter_name,
+                    dt_to_epoch_us(f.found_ts),
+                    dt_to_epoch_us(f.updated_ts),
+                )
+                for f in flats
+            ),
+        )
 
 
-def insert_flats(conn: sqlite3.Connection, flats: list[Flat], filter_name: str):
+def append_flat_history(conn: sqlite3.Connection, flats: list[Flat], seen_at: datetime):
+    """Records each observed `(price, updated_at)` state of the flats once, across filters.
+
+    States are unique by `(url, updated_at, price)`, with a missing price counted as one.
+    """
     cur = conn.cursor()
-    _insert_flats_unsafe(cur, flats, filter_name)
-    conn.commit()
+    with closing(cur):
+        cur.executemany(
+            f"""
+            INSERT OR IGNORE INTO {FLAT_HISTORY_TABLE} (url, price, updated_at, seen_at)
+            VALUES (?, ?, ?, ?)
+            """,
+            (
+                (
+                    f.url,
+                    f.price,
+                    dt_to_epoch_us(f.updated_ts),
+                    dt_to_epoch_us(seen_at),
+                )
+                for f in flats
+            ),
+        )
 
 
-def update_flats(conn: sqlite3.Connection, flats: list[Flat], filter_name: str):
+def touch_listings(conn: sqlite3.Connection, urls: list[str], seen_at: datetime):
+    """Marks the stored listings among `urls` as seen, including ones on unchanged pages."""
+    seen_at_us = dt_to_epoch_us(seen_at)
+    cur = conn.cursor()
+    with closing(cur):
+        cur.executemany(
+            f"""
+            UPDATE {LISTINGS_TABLE} SET last_seen_at = ?
+            WHERE url = ? AND (last_seen_at IS NULL OR last_seen_at < ?)
+            """,
+            ((seen_at_us, url, seen_at_us) for url in urls),
+        )
+
+
+def get_last_full_sweep_ts(conn: sqlite3.Connection, filter_name: str) -> datetime | None:
+    cur = conn.cursor()
+    with closing(cur):
+        res = cur.execute(
+            f"""
+            SELECT last_full_sweep_ts FROM {CRAWL_STATE_TABLE}
+            WHERE filter_name = ?
+        """,
+            [filter_name],
+        )
+        row = res.fetchone()
+    return epoch_us_to_dt(row[0]) if row and row[0] is not None else None
+
+
+def set_last_full_sweep_ts(conn: sqlite3.Connection, filter_name: str, ts: datetime):
     cur = conn.cursor()
-    urls_in_cond = ','.join([f"'{f.url}'" for f in flats])
-    sql = textwrap.dedent(
-        f"""\
-        DELETE FROM {FLATS_TABLE}
-        WHERE url IN ({urls_in_cond}) AND filter_name = '{filter_name}'
-    """
-    )
     with closing(cur):
-        cur.execute(sql)
-        _insert_flats_unsafe(cur, flats, filter_name)
-        conn.commit()
+        cur.execute(
+            f"""
+            INSERT OR REPLACE INTO {CRAWL_STATE_TABLE} (filter_name, last_full_sweep_ts)
+            VALUES (?, ?)
+        """,
+            [filter_name, dt_to_epoch_us(ts)],
+        )
@@ -0,0 +1,83 @@
+import queue
+import sqlite3
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future
+from typing import Any, TypeVar
+
+T = TypeVar('T')
+
+# Enough to keep the writer busy while the fetchers stay at most a few jobs ahead of it.
+DEFAULT_MAX_PENDING_JOBS = 64
+_STOP = object()
+
+
+class StorageWriter:
+    """Owns the SQLite connection and runs every job against it on one thread, in order.
+
+    Jobs are callables taking the connection as their first argument. Fetchers submit them
+    and get futures back, so network work goes on while the disk catches up, and SQLite
+    sees a single writer without any locking. The queue is bounded: when the disk falls
+    behind, `submit` blocks instead of piling up parsed pages in memory.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        max_pending_jobs: int = DEFAULT_MAX_PENDING_JOBS,
+    ):
+        self._jobs = queue.Queue(maxsize=max_pending_jobs)
+        self._connected = Future()
+        self._conn: sqlite3.Connection | None = None
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, args=(connect,), name='storage-writer', daemon=True
+        )
+        self._thread.start()
+        # Failures to open or migrate the DB surface here rather than in the first job.
+        self._connected.result()
+
+    def _run(self, connect: Callable[[], sqlite3.Connection]):
+        try:
+            self._conn = connect()
+        except BaseException as e:  # noqa: BLE001 -- re-raised by the constructor.
+            self._connected.set_exception(e)
+            return
+        self._connected.set_result(None)
+        try:
+            while (job := self._jobs.get()) is not _STOP:
+                self._execute(*job)
+        finally:
+            self._conn.close()
+
+    def _execute(self, future: Future, fn: Callable, args: tuple, kwargs: dict):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(self._conn, *args, **kwargs))
+        except BaseException as e:  # noqa: BLE001 -- re-raised by `Future.result()`.
+            future.set_exception(e)
+
+    def submit(self, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> 'Future[T]':
+        """Queues `fn(conn, *args, **kwargs)`, blocking while the queue is full."""
+        future = Future()
+        if threading.current_thread() is self._thread:
+            # A job submitting another one would wait for itself, so it runs right away.
+            self._execute(future, fn, args, kwargs)
+            return future
+        if self._closed:
+            raise RuntimeError('The storage writer is closed')
+        self._jobs.put((future, fn, args, kwargs))
+        return future
+
+    def call(self, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+        """Runs `fn(conn, *args, **kwargs)` on the writer and waits for the result."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def close(self):
+        """Runs the queued jobs, then closes the connection."""
+        if self._closed:
+            return
+        self._closed = True
+        self._jobs.put(_STOP)
+        self._thread.join()
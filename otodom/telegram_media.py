@@ -0,0 +1,116 @@
+"""Telegram references of uploaded photos, sent again without uploading the bytes.
+
+Every photo the bot uploads gets an id, an access hash and a file reference from Telegram.
+`data/sqlite/telegram_media.db` keeps them by the sha256 of the source URL, so a flat
+reported again as UPDATED, or a car offering updated on the site, refers to the photo
+Telegram already has. File references expire; the sender then uploads the photo again,
+see `otodom.telegram_sync.send_album`.
+"""
+
+import hashlib
+import pathlib
+import sqlite3
+import threading
+from collections.abc import Sequence
+from datetime import datetime
+
+from telethon.tl.types import InputPhoto, Photo
+
+from otodom.migrations import Migration, migrate
+from otodom.util import dt_to_epoch_us
+
+TELEGRAM_MEDIA_TABLE = 'telegram_media'
+
+
+def get_telegram_media_db_file(base_data_path: pathlib.Path) -> pathlib.Path:
+    return base_data_path / 'data' / 'sqlite' / 'telegram_media.db'
+
+
+def _url_hash(url: str) -> str:
+    return hashlib.sha256(url.encode('utf8')).hexdigest()
+
+
+def _telegram_media_table(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE telegram_media (
+            url_hash text PRIMARY KEY,
+            url text not null,
+            photo_id INTEGER not null,
+            access_hash INTEGER not null,
+            file_reference BLOB not null,
+            uploaded_at INTEGER not null
+        ) WITHOUT ROWID
+        """
+    )
+
+
+# Versioned by `PRAGMA user_version` of the media DB, like the flats DB in `otodom.migrations`.
+TELEGRAM_MEDIA_MIGRATIONS: list[Migration] = [_telegram_media_table]
+
+
+class TelegramMediaCache:
+    """The media table, safe to use from any thread."""
+
+    def __init__(self, path: pathlib.Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA busy_timeout = 5000')
+        migrate(self._conn, TELEGRAM_MEDIA_MIGRATIONS)
+        self._lock = threading.Lock()
+
+    def get(self, urls: Sequence[str]) -> dict[str, InputPhoto]:
+        """The references of the photos uploaded before, by their URL."""
+        hashes = {_url_hash(url): url for url in urls}
+        if not hashes:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT url_hash, url, photo_id, access_hash, file_reference
+                FROM {TELEGRAM_MEDIA_TABLE}
+                WHERE url_hash IN ({','.join('?' * len(hashes))})
+                """,
+                list(hashes),
+            ).fetchall()
+        return {
+            url: InputPhoto(id=photo_id, access_hash=access_hash, file_reference=file_reference)
+            for url_hash, url, photo_id, access_hash, file_reference in rows
+            # Guards against hash collisions.
+            if hashes[url_hash] == url
+        }
+
+    def put(self, photos: Sequence[tuple[str, Photo]]):
+        """Records the photos Telegram returned for the URLs, replacing older references."""
+        now_us = dt_to_epoch_us(datetime.now())
+        with self._lock:
+            self._conn.executemany(
+                f"""
+                INSERT OR REPLACE INTO {TELEGRAM_MEDIA_TABLE}
+                    (url_hash, url, photo_id, access_hash, file_reference, uploaded_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        _url_hash(url),
+                        url,
+                        photo.id,
+                        photo.access_hash,
+                        photo.file_reference,
+                        now_us,
+                    )
+                    for url, photo in photos
+                ],
+            )
+
+    def forget(self, urls: Sequence[str]):
+        with self._lock:
+            self._conn.executemany(
+                f'DELETE FROM {TELEGRAM_MEDIA_TABLE} WHERE url_hash = ?',
+                [(_url_hash(url),) for url in urls],
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
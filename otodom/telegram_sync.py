@@ -2,60 +2,238 @@ import asyncio
 import pathlib
 import re
 import tempfile
-from collections.abc import Sequence
-from typing import Literal, Self
+import threading
+from collections.abc import Coroutine, Iterator, Sequence
+from contextlib import ExitStack, contextmanager
+from typing import Any, Literal, Self, TypeVar
 
-import requests
 from loguru import logger
 from telethon import TelegramClient
+from telethon.errors import (
+    BadRequestError,
+    FileReferenceExpiredError,
+    FileReferenceInvalidError,
+)
 from telethon.hints import FileLike
+from telethon.tl.types import Message
+
+from otodom.photo_cache import PhotoCache
+from otodom.telegram_media import TelegramMediaCache
+
+T = TypeVar('T')
+
+
+@contextmanager
+def _local_photos(
+    photo_cache: PhotoCache | None, photo_urls: Sequence[str], skip_missing: bool = False
+) -> Iterator[list[pathlib.Path | None]]:
+    if photo_cache is not None:
+        with photo_cache.photos(photo_urls, skip_missing=skip_missing) as paths:
+            yield paths
+        return
+    # Without a data path the photos go through a throwaway cache.
+    with (
+        tempfile.TemporaryDirectory() as tmpdir,
+        PhotoCache(pathlib.Path(tmpdir)).photos(photo_urls, skip_missing=skip_missing) as paths,
+    ):
+        yield paths
+
+
+def _is_file_reference_error(e: BadRequestError) -> bool:
+    # Albums report the offending photo by its index, e.g. `FILE_REFERENCE_3_EXPIRED`.
+    return isinstance(e, FileReferenceExpiredError | FileReferenceInvalidError) or bool(
+        re.fullmatch(r'FILE_REFERENCE_\d+_(EXPIRED|INVALID)', e.message)
+    )
+
+
+def _split_album(
+    photo_urls: Sequence[str], files: Sequence[FileLike | None], captions: Sequence[str]
+) -> tuple[list[tuple[str, FileLike, str]], str]:
+    """Returns the `(url, file, caption)` of the photos to send and the captions of the rest."""
+    album = [
+        (url, file, caption)
+        for url, file, caption in zip(photo_urls, files, captions, strict=True)
+        if file is not None
+    ]
+    orphaned_text = '\n\n'.join(
+        caption for file, caption in zip(files, captions, strict=True) if file is None and caption
+    )
+    return album, orphaned_text
+
+
+async def _send_media(
+    client: TelegramClient,
+    chat_id: int | str,
+    album: Sequence[tuple[str, FileLike, str]],
+    parse_mode: Literal['md', 'html'],
+) -> list[Message]:
+    _, files, captions = (list(column) for column in zip(*album, strict=True))
+    messages = await client.send_file(
+        entity=chat_id,
+        # A single photo goes out as a plain captioned photo rather than an album.
+        file=files if len(files) > 1 else files[0],
+        caption=captions if len(files) > 1 else captions[0],
+        parse_mode=parse_mode,
+        force_document=False,
+    )
+    return messages if isinstance(messages, list) else [messages]
+
+
+async def send_album(
+    client: TelegramClient,
+    chat_id: int | str,
+    photo_urls: Sequence[str],
+    captions: Sequence[str],
+    parse_mode: Literal['md', 'html'],
+    photo_cache: PhotoCache | None = None,
+    media_cache: TelegramMediaCache | None = None,
+):
+    """Sends the photos as one media group, each photo with its own caption.
+
+    Photos gone from the server are left out and their captions go first as a text
+    message, so one dead link does not hold up the rest of the album. Photos uploaded
+    before are sent by their reference from `media_cache`; should Telegram reject a
+    reference as expired or invalid, the references are dropped and only the album is
+    sent again, with the photos uploaded anew.
+    """
+    reused = await asyncio.to_thread(media_cache.get, photo_urls) if media_cache else {}
+    # Unpinning the photos touches files, so the stack is closed off the event loop too.
+    stack = ExitStack()
+
+    async def local_photos(urls: list[str]) -> dict[str, pathlib.Path | None]:
+        if not urls:
+            return {}
+        paths = await asyncio.to_thread(
+            stack.enter_context, _local_photos(photo_cache, urls, skip_missing=True)
+        )
+        return dict(zip(urls, paths, strict=True))
+
+    try:
+        local_paths = await local_photos([url for url in photo_urls if url not in reused])
+        files = [reused.get(url) or local_paths[url] for url in photo_urls]
+        album, orphaned_text = _split_album(photo_urls, files, captions)
+        if orphaned_text:
+            await client.send_message(entity=chat_id, message=orphaned_text, parse_mode=parse_mode)
+        if not album:
+            return
+        try:
+            messages = await _send_media(client, chat_id, album, parse_mode)
+        except BadRequestError as e:
+            expired_urls = [url for url, _, _ in album if url in reused]
+            if not expired_urls or not _is_file_reference_error(e):
+                raise
+            logger.warning(
+                'Telegram rejected {} reused photos ({}), uploading them again',
+                len(expired_urls),
+                e,
+            )
+            await asyncio.to_thread(media_cache.forget, expired_urls)
+            fresh_paths = await local_photos(expired_urls)
+            album, orphaned_text = _split_album(
+                [url for url, _, _ in album],
+                [fresh_paths.get(url, file) for url, file, _ in album],
+                [caption for _, _, caption in album],
+            )
+            if orphaned_text:
+                await client.send_message(
+                    entity=chat_id, message=orphaned_text, parse_mode=parse_mode
+                )
+            if not album:
+                return
+            messages = await _send_media(client, chat_id, album, parse_mode)
+    finally:
+        await asyncio.to_thread(stack.close)
+    if media_cache is not None:
+        # Reused photos come back with a fresh file reference, which replaces the old one.
+        await asyncio.to_thread(
+            media_cache.put,
+            [
+                (url, message.photo)
+                for (url, _, _), message in zip(album, messages, strict=True)
+                if message.photo is not None
+            ],
+        )
 
 
 class SyncBot:
-    def __init__(self, client: TelegramClient, event_loop: asyncio.AbstractEventLoop):
+    """Blocking facade over a Telethon client whose event loop runs on a background thread.
+
+    The loop is shared with asynchronous senders such as `otodom.outbox.OutboxSender`,
+    which schedule their coroutines on `event_loop` directly.
+    """
+
+    def __init__(
+        self,
+        client: TelegramClient,
+        event_loop: asyncio.AbstractEventLoop,
+        photo_cache: PhotoCache | None = None,
+        media_cache: TelegramMediaCache | None = None,
+    ):
         self.event_loop = event_loop
         self.client = client
+        # Where photos are downloaded to and uploaded from, see `otodom.photo_cache`.
+        self.photo_cache = photo_cache
+        # Photos Telegram already has, see `otodom.telegram_media`.
+        self.media_cache = media_cache
 
     @classmethod
-    def from_bot_token(cls, api_id: int, api_hash: str, bot_token: str) -> Self:
-        event_loop = asyncio.get_event_loop()
-        client = TelegramClient(api_id=api_id, api_hash=api_hash, session='otodom').start(
-            bot_token=bot_token
+    def from_bot_token(
+        cls,
+        api_id: int,
+        api_hash: str,
+        bot_token: str,
+        photo_cache: PhotoCache | None = None,
+        media_cache: TelegramMediaCache | None = None,
+    ) -> Self:
+        event_loop = asyncio.new_event_loop()
+        threading.Thread(target=event_loop.run_forever, name='telegram', daemon=True).start()
+
+        async def start_client() -> TelegramClient:
+            client = TelegramClient(api_id=api_id, api_hash=api_hash, session='otodom')
+            await client.start(bot_token=bot_token)
+            return client
+
+        client = asyncio.run_coroutine_threadsafe(start_client(), event_loop).result()
+        return cls(
+            client=client, event_loop=event_loop, photo_cache=photo_cache, media_cache=media_cache
         )
 
-        return cls(client=client, event_loop=event_loop)
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        return asyncio.run_coroutine_threadsafe(coro, self.event_loop).result()
 
     def send_message(self, chat_id: int | str, text: str, parse_mode: Literal['md', 'html']):
-        return self.event_loop.run_until_complete(
+        return self.run(
             self.client.send_message(entity=chat_id, message=text, parse_mode=parse_mode)
         )
 
     def send_document(self, chat_id: int | str, document: FileLike):
-        return self.event_loop.run_until_complete(
-            self.client.send_file(entity=chat_id, file=document, force_document=True)
-        )
+        return self.run(self.client.send_file(entity=chat_id, file=document, force_document=True))
 
     def send_photo(self, chat_id: int | str, photo: FileLike | Sequence[FileLike]):
-        return self.event_loop.run_until_complete(
-            self.client.send_file(entity=chat_id, file=photo, force_document=False)
+        return self.run(self.client.send_file(entity=chat_id, file=photo, force_document=False))
+
+    def send_album(
+        self,
+        chat_id: int | str,
+        photo_urls: Sequence[str],
+        captions: Sequence[str],
+        parse_mode: Literal['md', 'html'],
+    ):
+        return self.run(
+            send_album(
+                self.client,
+                chat_id,
+                photo_urls,
+                captions,
+                parse_mode,
+                photo_cache=self.photo_cache,
+                media_cache=self.media_cache,
+            )
         )
 
     def send_photo_from_url(self, chat_id: int | str, photo_url: str | Sequence[str]):
         photo_urls = [photo_url] if isinstance(photo_url, str) else list(photo_url)
-
-        with tempfile.TemporaryDirectory() as tmpdir:
-            paths = []
-            for idx, photo_url in enumerate(photo_urls):
-                with (
-                    requests.get(photo_url, stream=True, timeout=15) as r,
-                    (path := pathlib.Path(tmpdir) / f'image_{idx}.jpg').open('wb') as f,
-                ):
-                    r.raise_for_status()
-                    logger.info('Downloading {} to {}', photo_url, str(path.absolute()))
-                    f.write(r.content)
-                    paths.append(path.absolute())
-
-            self.send_photo(chat_id, photo=paths)
+        self.send_album(chat_id, photo_urls, captions=[''] * len(photo_urls), parse_mode='md')
 
 
 def escape_markdown(text: str, version: int = 1, entity_type: str | None = None) -> str:
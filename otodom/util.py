@@ -1,8 +1,11 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Any
 
 import pytz
 
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
 
 def dt_to_naive_utc(dt: datetime) -> datetime:
     if not dt.tzinfo:
@@ -11,5 +14,14 @@ def dt_to_naive_utc(dt: datetime) -> datetime:
     return utc_time.replace(tzinfo=None)
 
 
+def dt_to_epoch_us(dt: datetime) -> int:
+    """Microseconds since the epoch; naive datetimes are taken as UTC, like in the DB."""
+    return (dt_to_naive_utc(dt) - _EPOCH) // _MICROSECOND
+
+
+def epoch_us_to_dt(epoch_us: int) -> datetime:
+    return _EPOCH + epoch_us * _MICROSECOND
+
+
 def is_not_none(x: Any) -> bool:
     return x is not None